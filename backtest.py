@@ -0,0 +1,969 @@
+import itertools
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from levels import (
+    DEFAULT_LEVEL_SPEC, LevelSpec, cached_levels, entry_levels_batch, first_cross_above, first_cross_below,
+    first_touch, round_to_tick,
+)
+
+
+# ==================== Trading Cost Calculation ====================
+def calculate_trading_costs(entry_price, exit_price, quantity, brokerage_per_order, stt_pct, txn_charges_pct, gst_pct):
+    """
+    Calculate total trading costs including brokerage, STT, transaction charges, and GST
+    """
+    turnover = (entry_price + exit_price) * quantity
+
+    # Brokerage (buy + sell)
+    brokerage_buy = brokerage_per_order
+    brokerage_sell = brokerage_per_order
+    total_brokerage = brokerage_buy + brokerage_sell
+
+    # STT (only on sell side for equity delivery/intraday)
+    stt = (exit_price * quantity) * (stt_pct / 100)
+
+    # Transaction charges (both sides)
+    txn_charges = turnover * (txn_charges_pct / 100)
+
+    # GST on brokerage and transaction charges
+    gst_base = total_brokerage + txn_charges
+    gst = gst_base * (gst_pct / 100)
+
+    # Total costs
+    total_cost = total_brokerage + stt + txn_charges + gst
+
+    return {
+        'brokerage': total_brokerage,
+        'stt': stt,
+        'transaction_charges': txn_charges,
+        'gst': gst,
+        'total': total_cost
+    }
+
+
+# ==================== Config / Result ====================
+@dataclass(frozen=True)
+class BacktestConfig:
+    """Everything the Simulation tab asks for, minus the data"""
+
+    position: str = "Long"                 # "Long" or "Short"
+    entry_mode: str = "Wait for Level"     # or "Immediate Entry"
+    trade_type: str = "Intraday"           # or "Position/Swing"
+    investment: float = 10000.0
+    max_loss_pct: float = 2.0              # capital risked per trade
+    max_total_loss_pct: float = 20.0       # stop trading below this drawdown from the start
+    recalc_levels: bool = False            # display only: Position/Swing re-anchors on the previous close while flat regardless
+    brokerage_per_trade: float = 20.0
+    stt_rate: float = 0.025
+    transaction_charges: float = 0.00325
+    gst_rate: float = 18.0
+    tick: float = 0.01
+    level_spec: LevelSpec = DEFAULT_LEVEL_SPEC
+
+    def costs(self, entry_price, exit_price, quantity):
+        return calculate_trading_costs(entry_price, exit_price, quantity, self.brokerage_per_trade,
+                                       self.stt_rate, self.transaction_charges, self.gst_rate)
+
+
+@dataclass
+class BacktestResult:
+    """
+    Output of BacktestEngine.run. Each trade is a dict with trade_num, entry_date,
+    entry_price, stop_loss, targets, position_size, position_type, remaining_size,
+    partial_exits (list of dicts: date, target, price, size, gross_pnl, costs, pnl),
+    exit_date, exit_price, result, gross_pnl, costs, pnl and capital_after.
+    `trade_log` holds the same dicts with bar positions for dates; `trades` turns
+    them into timestamps on first use, which summary statistics never need.
+    `level_history` is a sequence of the levels in force on each flat bar, and
+    `equity` the capital after the trades closed up to each bar.
+    """
+
+    config: BacktestConfig
+    index: pd.DatetimeIndex
+    start_price: float
+    initial_levels: dict
+    final_levels: dict
+    trade_log: list = field(default_factory=list)
+    level_history: Sequence = ()
+    equity: np.ndarray = None
+    final_capital: float = 0.0
+    cumulative_pnl: float = 0.0
+    total_costs: float = 0.0
+    total_brokerage: float = 0.0
+
+    @cached_property
+    def trades(self):
+        return stamp_trades(self.trade_log, self.index)
+
+    @property
+    def initial_capital(self):
+        return self.config.investment
+
+    @property
+    def last_setup(self):
+        """(entry, stop loss, targets) most recently set up, for drawing on the chart"""
+        last = self.level_history[-1]
+        return last['entry'], last['sl'], last['targets']
+
+    @property
+    def partial_exits(self):
+        """Every partial exit, tagged with its trade number"""
+        return [dict(pe, trade_num=t['trade_num']) for t in self.trades for pe in t['partial_exits']]
+
+    @property
+    def return_pct(self):
+        return (self.final_capital - self.initial_capital) / self.initial_capital * 100
+
+    @property
+    def win_rate(self):
+        if not self.trade_log:
+            return 0
+        return len([t for t in self.trade_log if t['pnl'] > 0]) / len(self.trade_log) * 100
+
+
+def stamp_trades(log, index):
+    """Copies of the trades in `log` with their bar positions turned into timestamps of `index`"""
+    positions = {t['entry_date'] for t in log} | {t['exit_date'] for t in log}
+    positions |= {pe['date'] for t in log for pe in t['partial_exits']}
+    positions = sorted(positions)
+    stamp = dict(zip(positions, index[positions])) if positions else {}
+    return [
+        dict(t, entry_date=stamp[t['entry_date']], exit_date=stamp[t['exit_date']],
+             partial_exits=[dict(pe, date=stamp[pe['date']]) for pe in t['partial_exits']])
+        for t in log
+    ]
+
+
+# ==================== Engine ====================
+class BacktestEngine:
+    """
+    Risk-based multi-trade Square-of-9 backtest, headless. Rules: entries at the
+    buy/sell level (or at the open in Immediate Entry mode), stop first then
+    targets, partial exits of a third per target while holding, intraday positions
+    closed on the last bar of the day, and trading stops once capital falls to the
+    max-total-loss floor. run() uses the array kernel, run_reference() a bar loop.
+    """
+
+    def __init__(self, config):
+        self.config = config
+
+    def run(self, bars):
+        """Backtest compact `bars` (bar_store.Bars); returns a BacktestResult"""
+        return run_kernel(self.config, bars)
+
+    def run_reference(self, bars):
+        """
+        The same backtest as a plain bar-by-bar loop. It states the rules in their
+        most readable form; run() must agree with it trade for trade.
+        """
+        cfg = self.config
+        position, trade_type = cfg.position, cfg.trade_type
+        index = bars.index
+        dates = index.date
+        n = len(index)
+
+        start_price = float(bars.open[0])
+        initial_levels = cached_levels(start_price, cfg.tick, cfg.level_spec)
+
+        initial_capital = cfg.investment
+        current_capital = cfg.investment
+        min_capital = cfg.investment - cfg.investment * (cfg.max_total_loss_pct / 100)
+
+        all_trades = []
+        trade_count = 0
+        cumulative_pnl = 0
+        total_brokerage_paid = 0
+        total_costs_paid = 0
+        level_history = []
+
+        prev_close = start_price
+        in_trade = False
+        current_trade = {}
+        current_levels = initial_levels
+
+        def close_trade_with_costs(entry_p, exit_p, qty, gross_pnl):
+            costs = cfg.costs(entry_p, exit_p, qty)
+            net_pnl = gross_pnl - costs['total']
+            return net_pnl, costs['total'], costs['brokerage']
+
+        bar_rows = zip(index, bars.open.tolist(), bars.high.tolist(), bars.low.tolist(), bars.close.tolist())
+        for day_idx, (idx, open_price, high, low, close_price) in enumerate(bar_rows):
+
+            # Check if we've hit max loss limit
+            if current_capital <= min_capital:
+                break
+
+            # Recalculate levels if needed
+            if day_idx == 0:
+                current_levels = initial_levels
+                calc_price = start_price
+                current_trading_day = dates[0]
+            elif trade_type == "Position/Swing" and cfg.recalc_levels and not in_trade:
+                current_levels = cached_levels(prev_close, cfg.tick, cfg.level_spec)
+                calc_price = prev_close
+            elif not in_trade:
+                if trade_type == "Intraday":
+                    # Levels recalculate only at the start of a new trading day
+                    if dates[day_idx] != current_trading_day:
+                        current_levels = cached_levels(open_price, cfg.tick, cfg.level_spec)
+                        calc_price = open_price
+                        current_trading_day = dates[day_idx]
+                else:
+                    current_levels = cached_levels(prev_close, cfg.tick, cfg.level_spec)
+                    calc_price = prev_close
+
+            # Determine entry, SL, targets if not in trade
+            if not in_trade:
+                if trade_type == "Intraday":
+                    if position == "Long":
+                        entry_price = current_levels['buy']
+                        stop_loss = current_levels['sell']
+                        targets = current_levels['bull_targets'][:3]
+                    else:
+                        entry_price = current_levels['sell']
+                        stop_loss = current_levels['buy']
+                        targets = current_levels['bear_targets'][:3]
+                else:  # Position/Swing
+                    if position == "Long":
+                        entry_price = current_levels['buy']
+                        stop_loss = current_levels['supports'][0]
+                        targets = current_levels['resistances'][:3]
+                    else:
+                        entry_price = current_levels['sell']
+                        stop_loss = current_levels['resistances'][0]
+                        targets = current_levels['supports'][:3]
+
+                level_history.append({
+                    'date': idx,
+                    'calc_price': calc_price,
+                    'entry': entry_price,
+                    'sl': stop_loss,
+                    'targets': list(targets)
+                })
+
+                # Check if entry was triggered
+                entry_triggered = False
+                actual_entry_price = entry_price
+
+                if cfg.entry_mode == "Wait for Level":
+                    # Wait for price to reach the calculated level
+                    if low <= entry_price <= high:
+                        entry_triggered = True
+                        actual_entry_price = entry_price
+                else:
+                    # Immediate Entry: enter at the open when it is at or better than the level
+                    if position == "Long":
+                        if open_price <= entry_price:
+                            entry_triggered = True
+                            actual_entry_price = open_price
+                    else:
+                        if open_price >= entry_price:
+                            entry_triggered = True
+                            actual_entry_price = open_price
+
+                if entry_triggered:
+                    risk_per_share = abs(actual_entry_price - stop_loss)
+                    if risk_per_share > 0:
+                        max_risk_amount = current_capital * (cfg.max_loss_pct / 100)
+                        position_size = int(max_risk_amount / risk_per_share)
+                        position_size = max(1, min(position_size, int(current_capital / actual_entry_price)))
+                    else:
+                        position_size = int(current_capital / actual_entry_price)
+
+                    in_trade = True
+                    trade_count += 1
+                    current_trade = {
+                        'trade_num': trade_count,
+                        'entry_date': day_idx,
+                        'entry_price': actual_entry_price,
+                        'stop_loss': stop_loss,
+                        'targets': list(targets),
+                        'position_size': position_size,
+                        'position_type': position,
+                        'remaining_size': position_size,
+                        'partial_exits': []
+                    }
+
+                    # Intraday checks the entry candle itself; Position/Swing holds
+                    # (the same-candle P&L is measured from the level, not the fill)
+                    if trade_type == "Intraday":
+                        exit_price = None
+                        if position == "Long":
+                            if low <= stop_loss:
+                                exit_price, result = stop_loss, "Stop Loss Hit"
+                            else:
+                                for i in range(len(targets)-1, -1, -1):
+                                    if high >= targets[i]:
+                                        exit_price, result = targets[i], f"Target {i+1} Hit"
+                                        break
+                            if exit_price is not None:
+                                pnl_per_share = exit_price - entry_price
+                        else:
+                            if high >= stop_loss:
+                                exit_price, result = stop_loss, "Stop Loss Hit"
+                            else:
+                                for i in range(len(targets)-1, -1, -1):
+                                    if low <= targets[i]:
+                                        exit_price, result = targets[i], f"Target {i+1} Hit"
+                                        break
+                            if exit_price is not None:
+                                pnl_per_share = entry_price - exit_price
+
+                        if exit_price is not None:
+                            gross_pnl = pnl_per_share * position_size
+                            net_pnl, total_cost, brokerage = close_trade_with_costs(entry_price, exit_price, position_size, gross_pnl)
+
+                            current_capital += net_pnl
+                            cumulative_pnl += net_pnl
+                            total_costs_paid += total_cost
+                            total_brokerage_paid += brokerage
+
+                            current_trade.update({
+                                'exit_date': day_idx,
+                                'exit_price': exit_price,
+                                'result': result,
+                                'gross_pnl': gross_pnl,
+                                'costs': total_cost,
+                                'pnl': net_pnl,
+                                'capital_after': current_capital
+                            })
+                            all_trades.append(current_trade.copy())
+                            in_trade = False
+            else:
+                # In trade - stop loss first, then partial profits at each target
+                entry = current_trade['entry_price']
+                stop_hit = low <= current_trade['stop_loss'] if position == "Long" else high >= current_trade['stop_loss']
+                if stop_hit:
+                    exit_price = current_trade['stop_loss']
+                    remaining = current_trade['remaining_size']
+                    pnl_per_share = (exit_price - entry) if position == "Long" else (entry - exit_price)
+                    gross_pnl = pnl_per_share * remaining
+                    net_pnl, total_cost, brokerage = close_trade_with_costs(entry, exit_price, remaining, gross_pnl)
+
+                    current_capital += net_pnl
+                    cumulative_pnl += net_pnl
+                    total_costs_paid += total_cost
+                    total_brokerage_paid += brokerage
+
+                    current_trade.update({
+                        'exit_date': day_idx,
+                        'exit_price': exit_price,
+                        'result': "Stop Loss Hit",
+                        'gross_pnl': gross_pnl,
+                        'costs': total_cost,
+                        'pnl': net_pnl,
+                        'capital_after': current_capital
+                    })
+                    all_trades.append(current_trade.copy())
+                    in_trade = False
+                else:
+                    trade_targets = current_trade['targets']
+                    for i, target in enumerate(trade_targets):
+                        reached = high >= target if position == "Long" else low <= target
+                        if reached and current_trade['remaining_size'] > 0:
+                            # Partial exit: 1/3 of the remaining position at each target, the rest at the last
+                            exit_size = max(1, current_trade['remaining_size'] // 3) if i < len(trade_targets)-1 else current_trade['remaining_size']
+                            pnl_per_share = (target - entry) if position == "Long" else (entry - target)
+                            gross_partial_pnl = pnl_per_share * exit_size
+                            net_partial_pnl, partial_cost, partial_broker = close_trade_with_costs(entry, target, exit_size, gross_partial_pnl)
+
+                            current_capital += net_partial_pnl
+                            cumulative_pnl += net_partial_pnl
+                            total_costs_paid += partial_cost
+                            total_brokerage_paid += partial_broker
+
+                            current_trade['remaining_size'] -= exit_size
+                            current_trade['partial_exits'].append({
+                                'date': day_idx,
+                                'target': i+1,
+                                'price': target,
+                                'size': exit_size,
+                                'gross_pnl': gross_partial_pnl,
+                                'costs': partial_cost,
+                                'pnl': net_partial_pnl
+                            })
+
+                            # If all position closed
+                            if current_trade['remaining_size'] <= 0:
+                                partials = current_trade['partial_exits']
+                                current_trade.update({
+                                    'exit_date': day_idx,
+                                    'exit_price': target,
+                                    'result': f"All Targets Hit (Final: T{i+1})",
+                                    'gross_pnl': sum([pe['gross_pnl'] for pe in partials]),
+                                    'costs': sum([pe['costs'] for pe in partials]),
+                                    'pnl': sum([pe['pnl'] for pe in partials]),
+                                    'capital_after': current_capital
+                                })
+                                all_trades.append(current_trade.copy())
+                                in_trade = False
+                                break
+
+                # For intraday, must exit by end of trading day
+                if trade_type == "Intraday" and in_trade:
+                    is_last_candle_of_day = day_idx == n - 1 or dates[day_idx] != dates[day_idx + 1]
+                    if is_last_candle_of_day:
+                        exit_price = close_price
+                        remaining = current_trade['remaining_size']
+                        pnl_per_share = (exit_price - entry) if position == "Long" else (entry - exit_price)
+                        gross_pnl = pnl_per_share * remaining
+                        net_pnl, total_cost, brokerage = close_trade_with_costs(entry, exit_price, remaining, gross_pnl)
+
+                        # Add to any partial profits already taken (they already have costs deducted)
+                        partials = current_trade['partial_exits']
+                        if partials:
+                            net_pnl += sum([pe['pnl'] for pe in partials])
+
+                        current_capital += net_pnl
+                        cumulative_pnl += net_pnl
+                        total_costs_paid += total_cost
+                        total_brokerage_paid += brokerage
+
+                        current_trade.update({
+                            'exit_date': day_idx,
+                            'exit_price': exit_price,
+                            'result': "EOD Exit" if partials else "Position Open (Exited at Close)",
+                            'gross_pnl': gross_pnl + (sum([pe['gross_pnl'] for pe in partials]) if partials else 0),
+                            'costs': total_cost + (sum([pe['costs'] for pe in partials]) if partials else 0),
+                            'pnl': net_pnl,
+                            'capital_after': current_capital
+                        })
+                        all_trades.append(current_trade.copy())
+                        in_trade = False
+
+            # Update previous close
+            prev_close = close_price
+
+        # Close any open position at end
+        if in_trade:
+            exit_price = float(bars.close[-1])
+            entry = current_trade['entry_price']
+            pnl_per_share = (exit_price - entry) if position == "Long" else (entry - exit_price)
+            remaining = current_trade['remaining_size']
+            gross_pnl = pnl_per_share * remaining
+            net_pnl, total_cost, brokerage = close_trade_with_costs(entry, exit_price, remaining, gross_pnl)
+
+            # Add partial exit profits
+            partials = current_trade['partial_exits']
+            if partials:
+                net_pnl += sum([pe['pnl'] for pe in partials])
+                gross_pnl += sum([pe['gross_pnl'] for pe in partials])
+                total_cost += sum([pe['costs'] for pe in partials])
+
+            current_capital += net_pnl
+            cumulative_pnl += net_pnl
+            total_costs_paid += total_cost
+            total_brokerage_paid += brokerage
+
+            current_trade.update({
+                'exit_date': n - 1,
+                'exit_price': exit_price,
+                'result': "Position Open (Exited at Close)",
+                'gross_pnl': gross_pnl,
+                'costs': total_cost,
+                'pnl': net_pnl,
+                'capital_after': current_capital
+            })
+            all_trades.append(current_trade.copy())
+
+        return BacktestResult(
+            config=cfg,
+            index=index,
+            start_price=start_price,
+            initial_levels=initial_levels,
+            final_levels=current_levels,
+            trade_log=all_trades,
+            level_history=level_history,
+            equity=equity_curve(n, all_trades, initial_capital),
+            final_capital=current_capital,
+            cumulative_pnl=cumulative_pnl,
+            total_costs=total_costs_paid,
+            total_brokerage=total_brokerage_paid,
+        )
+
+
+def equity_curve(n_bars, trades, initial_capital):
+    """Capital after the trades that closed on or before each bar (trade dates as bar positions)"""
+    exits = np.array([t['exit_date'] for t in trades], dtype=np.int64)
+    capital = np.array([initial_capital] + [t['capital_after'] for t in trades], dtype=np.float64)
+    return capital[np.cumsum(np.bincount(exits, minlength=n_bars))]
+
+
+# ==================== Array kernel ====================
+def day_bounds(days, starts=()):
+    """
+    (first bar of each day, day number of each bar) for a run-length view of `days`;
+    `starts` force extra boundaries, such as where concatenated series meet
+    """
+    n = len(days)
+    firsts = np.r_[0, np.flatnonzero(days[1:] != days[:-1]) + 1]
+    if len(starts):
+        firsts = np.union1d(firsts, starts)
+    return firsts, np.repeat(np.arange(len(firsts)), np.diff(np.r_[firsts, n]))
+
+
+def _setup(levels, long, intraday):
+    """(entry, stop loss, targets) a flat strategy trades from `levels`"""
+    if intraday:
+        if long:
+            return levels['buy'], levels['sell'], levels['bull_targets'][:3]
+        return levels['sell'], levels['buy'], levels['bear_targets'][:3]
+    if long:
+        return levels['buy'], levels['supports'][0], levels['resistances'][:3]
+    return levels['sell'], levels['resistances'][0], levels['supports'][:3]
+
+
+class LevelHistory(Sequence):
+    """
+    Levels in force on each bar the strategy was flat, as the bar loop records them
+    (date, calc_price, entry, sl, targets). Kept as stretches of flat bars and only
+    expanded when read.
+    """
+
+    def __init__(self, index, runs, anchors, setup):
+        self.index = index
+        self.runs = runs        # (first bar, end bar, anchor price, or None for each bar's own in `anchors`)
+        self.anchors = anchors
+        self.setup = setup      # anchor price -> (entry, stop loss, targets)
+
+    def __len__(self):
+        return sum(b - a for a, b, _ in self.runs)
+
+    @cached_property
+    def _rows(self):
+        if not self.runs:
+            return self.index[:0], []
+        positions = np.concatenate([np.arange(a, b) for a, b, _ in self.runs])
+        calc = np.concatenate([self.anchors[a:b] if anchor is None else np.full(b - a, anchor)
+                               for a, b, anchor in self.runs])
+        return self.index[positions], calc.tolist()
+
+    def _item(self, date, calc_price):
+        entry, sl, targets = self.setup(calc_price)
+        return {'date': date, 'calc_price': calc_price, 'entry': entry, 'sl': sl, 'targets': list(targets)}
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        dates, calc = self._rows
+        return self._item(dates[i], calc[i])
+
+    def __iter__(self):
+        dates, calc = self._rows
+        for date, calc_price in zip(dates, calc):
+            yield self._item(date, calc_price)
+
+
+def _first_exit(h, lo, stop, target, long):
+    """Position of the first bar reaching `stop` or `target`, or len(h) if none does"""
+    if long:
+        return int(min(first_cross_below(lo, stop), first_cross_above(h, target)))
+    return int(min(first_cross_above(h, stop), first_cross_below(lo, target)))
+
+
+def entry_signals(cfg, o, h, lo, c, firsts, day_of, tick, starts=()):
+    """
+    (anchor, entry bars) of the usual flat schedule: each bar trades from levels
+    anchored on its day's first open (Intraday) or the previous close
+    (Position/Swing), and `entry bars` are the positions where that level fills.
+    Several series can be scored in one pass by concatenating them: `starts` are
+    the positions where a new series begins (also day starts in `firsts`) and
+    `tick` may then be a per-bar array.
+    """
+    long = cfg.position == "Long"
+    tick = np.broadcast_to(np.asarray(tick, dtype=np.float64), o.shape)
+    if cfg.trade_type == "Intraday":
+        buy, sell = entry_levels_batch(round_to_tick(o[firsts], tick[firsts]), cfg.level_spec)
+        anchors = o[firsts][day_of]
+        entries = (buy if long else sell)[day_of]
+    else:
+        starts = np.asarray(starts, dtype=np.int64)
+        anchors = np.r_[o[:1], c[:-1]]
+        anchors[starts] = o[starts]
+        buy, sell = entry_levels_batch(round_to_tick(anchors, tick), cfg.level_spec)
+        entries = buy if long else sell
+    if cfg.entry_mode == "Wait for Level":
+        entry_ok = (lo <= entries) & (entries <= h)
+    elif long:
+        entry_ok = o <= entries
+    else:
+        entry_ok = o >= entries
+    return anchors, np.flatnonzero(entry_ok)
+
+
+def walk_bars(cfg, bars, trades, numbers, signals=None):
+    """
+    The array kernel for one symbol as a generator, so that a driver owns the
+    capital. Instead of visiting every bar it jumps between events: entries come
+    from entry_signals, exits from a search for the next bar that reaches the stop
+    or the nearest target (or ends the day). Only event bars run scalar code, and
+    that code is the bar loop's.
+
+    Protocol: it yields (bar, capital, exposure) before each event, with bar ==
+    len(bars) once the data is exhausted, and is sent (capital, cash, halt). With
+    halt None it processes the event at capital `capital`; entries are sized
+    within `cash` unless that is None (single-symbol rules). A halt bar ends the
+    walk there, closing any open position at that bar's close. Closed trades are
+    appended to `trades` and numbered from the iterator `numbers`; the walk
+    returns its totals and levels.
+    """
+    long = cfg.position == "Long"
+    intraday = cfg.trade_type == "Intraday"
+    wait = cfg.entry_mode == "Wait for Level"
+    o = bars.open.astype(np.float64)
+    h = bars.high.astype(np.float64)
+    lo = bars.low.astype(np.float64)
+    c = bars.close.astype(np.float64)
+    n = len(o)
+    days = bars.days
+    firsts, day_of = day_bounds(days)
+    day_start = firsts[day_of]
+    day_end = (np.r_[firsts[1:], n] - 1)[day_of]
+
+    start_price = float(o[0])
+    initial_levels = cached_levels(start_price, cfg.tick, cfg.level_spec)
+    risk_frac = cfg.max_loss_pct / 100
+    capital = cfg.investment
+
+    setups = {}
+
+    def setup(anchor):
+        # Keyed like the level table: anchors within half a tick share their levels
+        ticks = round(anchor / cfg.tick)
+        found = setups.get(ticks)
+        if found is None:
+            found = setups[ticks] = _setup(cached_levels(anchor, cfg.tick, cfg.level_spec), long, intraday)
+        return found
+
+    if signals is None:
+        signals = entry_signals(cfg, o, h, lo, c, firsts, day_of, cfg.tick)
+    anchors, entry_bars = signals
+
+    rates = (cfg.brokerage_per_trade, cfg.stt_rate, cfg.transaction_charges, cfg.gst_rate)
+
+    def costs(entry_p, exit_p, qty, gross_pnl):
+        cost = calculate_trading_costs(entry_p, exit_p, qty, *rates)
+        return gross_pnl - cost['total'], cost['total'], cost['brokerage']
+
+    cumulative_pnl = 0
+    total_costs_paid = 0
+    total_brokerage_paid = 0
+    flat_runs = []
+    committed = 0           # flat runs up to here were walked before the last event went ahead
+
+    current_day = days[0]
+    custom = None           # Intraday anchor after a carried-over trade closed mid-day
+    in_trade = False
+    close_at = None         # set by a halt from the driver
+    i = 0
+    while i < n:
+        if not in_trade:
+            if intraday and days[i] != current_day:
+                current_day = days[i]
+                custom = float(o[i]) if day_start[i] != i else None
+            if custom is not None:
+                entry_price, stop_loss, targets = setup(custom)
+                end = day_end[i] + 1
+                if wait:
+                    j = i + int(first_touch(h[i:end], lo[i:end], entry_price)[0])
+                elif long:
+                    j = i + int(first_cross_below(o[i:end], entry_price))
+                else:
+                    j = i + int(first_cross_above(o[i:end], entry_price))
+                flat_runs.append((i, min(j + 1, end), custom))
+                if j == end:
+                    i = end
+                    continue
+            else:
+                k = entry_bars.searchsorted(i)
+                j = int(entry_bars[k]) if k < len(entry_bars) else n
+                flat_runs.append((i, min(j + 1, n), None))
+                if j == n:
+                    break
+                current_day = days[j]
+                entry_price, stop_loss, targets = setup(float(anchors[j]))
+
+            capital, cash, halt = yield j, capital, 0.0
+            if halt is not None:
+                close_at = halt
+                break
+            committed = len(flat_runs)
+
+            actual_entry_price = entry_price if wait else float(o[j])
+            affordable = int((capital if cash is None else cash) / actual_entry_price)
+            i = j + 1
+            if cash is not None and affordable < 1:
+                # Shared capital is tied up in other positions: let this signal pass
+                continue
+            risk_per_share = abs(actual_entry_price - stop_loss)
+            if risk_per_share > 0:
+                position_size = int(capital * risk_frac / risk_per_share)
+                position_size = max(1, min(position_size, affordable))
+            else:
+                position_size = affordable
+            trade = {
+                'trade_num': next(numbers),
+                'entry_date': j,
+                'entry_price': actual_entry_price,
+                'stop_loss': stop_loss,
+                'targets': list(targets),
+                'position_size': position_size,
+                'position_type': cfg.position,
+                'remaining_size': position_size,
+                'partial_exits': []
+            }
+
+            if intraday:
+                # Same-candle exit, measured from the level as in the bar loop
+                high, low = float(h[j]), float(lo[j])
+                exit_price = None
+                if long:
+                    if low <= stop_loss:
+                        exit_price, result = stop_loss, "Stop Loss Hit"
+                    else:
+                        for t in range(len(targets)-1, -1, -1):
+                            if high >= targets[t]:
+                                exit_price, result = targets[t], f"Target {t+1} Hit"
+                                break
+                    if exit_price is not None:
+                        pnl_per_share = exit_price - entry_price
+                else:
+                    if high >= stop_loss:
+                        exit_price, result = stop_loss, "Stop Loss Hit"
+                    else:
+                        for t in range(len(targets)-1, -1, -1):
+                            if low <= targets[t]:
+                                exit_price, result = targets[t], f"Target {t+1} Hit"
+                                break
+                    if exit_price is not None:
+                        pnl_per_share = entry_price - exit_price
+
+                if exit_price is not None:
+                    gross_pnl = pnl_per_share * position_size
+                    net_pnl, total_cost, brokerage = costs(entry_price, exit_price, position_size, gross_pnl)
+                    capital += net_pnl
+                    cumulative_pnl += net_pnl
+                    total_costs_paid += total_cost
+                    total_brokerage_paid += brokerage
+                    trade.update({
+                        'exit_date': j,
+                        'exit_price': exit_price,
+                        'result': result,
+                        'gross_pnl': gross_pnl,
+                        'costs': total_cost,
+                        'pnl': net_pnl,
+                        'capital_after': capital
+                    })
+                    trades.append(trade)
+                    continue
+
+            in_trade = True
+            entry = actual_entry_price
+            trade_stop = stop_loss
+            trade_targets = trade['targets']
+            last_target = len(trade_targets) - 1
+            nearest = min(trade_targets) if long else max(trade_targets)
+            remaining = position_size
+            partials = trade['partial_exits']
+            continue
+
+        # In trade: the next bar that reaches the stop or a target. Intraday also
+        # stops at the day's last bar; Position/Swing searches widening windows.
+        # Stops are often hit on the very next bar, which is cheaper to test alone.
+        if (lo[i] <= trade_stop or h[i] >= nearest) if long else (h[i] >= trade_stop or lo[i] <= nearest):
+            j = i
+        elif intraday:
+            end = day_end[i] + 1
+            j = i + _first_exit(h[i:end], lo[i:end], trade_stop, nearest, long)
+            j = min(j, end - 1)
+        else:
+            j, a, width = n, i, 64
+            while j == n and a < n:
+                b = min(n, a + width)
+                j = a + _first_exit(h[a:b], lo[a:b], trade_stop, nearest, long)
+                j = n if j == b else j
+                a, width = b, width * 4
+            if j == n:
+                break
+
+        capital, cash, halt = yield j, capital, entry * remaining
+        if halt is not None:
+            close_at = halt
+            break
+        i = j + 1
+
+        high, low = float(h[j]), float(lo[j])
+        stop_hit = low <= trade_stop if long else high >= trade_stop
+        if stop_hit:
+            exit_price = trade_stop
+            pnl_per_share = (exit_price - entry) if long else (entry - exit_price)
+            gross_pnl = pnl_per_share * remaining
+            net_pnl, total_cost, brokerage = costs(entry, exit_price, remaining, gross_pnl)
+            capital += net_pnl
+            cumulative_pnl += net_pnl
+            total_costs_paid += total_cost
+            total_brokerage_paid += brokerage
+            trade.update({
+                'remaining_size': remaining,
+                'exit_date': j,
+                'exit_price': exit_price,
+                'result': "Stop Loss Hit",
+                'gross_pnl': gross_pnl,
+                'costs': total_cost,
+                'pnl': net_pnl,
+                'capital_after': capital
+            })
+            trades.append(trade)
+            in_trade = False
+        else:
+            for t, target in enumerate(trade_targets):
+                reached = high >= target if long else low <= target
+                if reached and remaining > 0:
+                    exit_size = max(1, remaining // 3) if t < last_target else remaining
+                    pnl_per_share = (target - entry) if long else (entry - target)
+                    gross_partial_pnl = pnl_per_share * exit_size
+                    net_partial_pnl, partial_cost, partial_broker = costs(entry, target, exit_size, gross_partial_pnl)
+                    capital += net_partial_pnl
+                    cumulative_pnl += net_partial_pnl
+                    total_costs_paid += partial_cost
+                    total_brokerage_paid += partial_broker
+                    remaining -= exit_size
+                    partials.append({
+                        'date': j,
+                        'target': t+1,
+                        'price': target,
+                        'size': exit_size,
+                        'gross_pnl': gross_partial_pnl,
+                        'costs': partial_cost,
+                        'pnl': net_partial_pnl
+                    })
+                    if remaining <= 0:
+                        trade.update({
+                            'remaining_size': remaining,
+                            'exit_date': j,
+                            'exit_price': target,
+                            'result': f"All Targets Hit (Final: T{t+1})",
+                            'gross_pnl': sum([pe['gross_pnl'] for pe in partials]),
+                            'costs': sum([pe['costs'] for pe in partials]),
+                            'pnl': sum([pe['pnl'] for pe in partials]),
+                            'capital_after': capital
+                        })
+                        trades.append(trade)
+                        in_trade = False
+                        break
+
+        if intraday and in_trade and day_end[j] == j:
+            exit_price = float(c[j])
+            pnl_per_share = (exit_price - entry) if long else (entry - exit_price)
+            gross_pnl = pnl_per_share * remaining
+            net_pnl, total_cost, brokerage = costs(entry, exit_price, remaining, gross_pnl)
+            if partials:
+                net_pnl += sum([pe['pnl'] for pe in partials])
+            capital += net_pnl
+            cumulative_pnl += net_pnl
+            total_costs_paid += total_cost
+            total_brokerage_paid += brokerage
+            trade.update({
+                'remaining_size': remaining,
+                'exit_date': j,
+                'exit_price': exit_price,
+                'result': "EOD Exit" if partials else "Position Open (Exited at Close)",
+                'gross_pnl': gross_pnl + (sum([pe['gross_pnl'] for pe in partials]) if partials else 0),
+                'costs': total_cost + (sum([pe['costs'] for pe in partials]) if partials else 0),
+                'pnl': net_pnl,
+                'capital_after': capital
+            })
+            trades.append(trade)
+            in_trade = False
+
+    if close_at is None:
+        # Out of data: the driver still gets a say before open positions are settled
+        capital, cash, close_at = yield n, capital, entry * remaining if in_trade else 0.0
+    if close_at is None:
+        close_at = n - 1
+    else:
+        # Halted: the flat stretch walked since the last event was never traded from
+        del flat_runs[committed:]
+
+    if in_trade:
+        exit_price = float(c[close_at])
+        pnl_per_share = (exit_price - entry) if long else (entry - exit_price)
+        gross_pnl = pnl_per_share * remaining
+        net_pnl, total_cost, brokerage = costs(entry, exit_price, remaining, gross_pnl)
+        if partials:
+            net_pnl += sum([pe['pnl'] for pe in partials])
+            gross_pnl += sum([pe['gross_pnl'] for pe in partials])
+            total_cost += sum([pe['costs'] for pe in partials])
+        capital += net_pnl
+        cumulative_pnl += net_pnl
+        total_costs_paid += total_cost
+        total_brokerage_paid += brokerage
+        trade.update({
+            'remaining_size': remaining,
+            'exit_date': close_at,
+            'exit_price': exit_price,
+            'result': "Position Open (Exited at Close)",
+            'gross_pnl': gross_pnl,
+            'costs': total_cost,
+            'pnl': net_pnl,
+            'capital_after': capital
+        })
+        trades.append(trade)
+
+    # Levels in force when the walk stopped: those of the last flat bar
+    if flat_runs:
+        a, b, anchor = flat_runs[-1]
+        final_levels = cached_levels(float(anchors[b - 1]) if anchor is None else anchor, cfg.tick, cfg.level_spec)
+    else:
+        final_levels = initial_levels
+
+    return {
+        'start_price': start_price,
+        'initial_levels': initial_levels,
+        'final_levels': final_levels,
+        'level_history': LevelHistory(bars.index, flat_runs, anchors, setup),
+        'capital': capital,
+        'cumulative_pnl': cumulative_pnl,
+        'total_costs': total_costs_paid,
+        'total_brokerage': total_brokerage_paid,
+    }
+
+
+def run_kernel(cfg, bars):
+    """
+    BacktestEngine.run: walk_bars driven on its own capital, trading until the data
+    ends or capital falls to the max-total-loss floor. The trades are bit-identical
+    to run_reference.
+    """
+    n = len(bars)
+    min_capital = cfg.investment - cfg.investment * (cfg.max_total_loss_pct / 100)
+    trades = []
+    walk = walk_bars(cfg, bars, trades, itertools.count(1))
+    _, capital, _ = next(walk)
+    try:
+        while True:
+            # Below the floor the bar loop stops and settles an open position at the last close
+            halt = n - 1 if capital <= min_capital else None
+            _, capital, _ = walk.send((capital, None, halt))
+    except StopIteration as done:
+        summary = done.value
+
+    return BacktestResult(
+        config=cfg,
+        index=bars.index,
+        start_price=summary['start_price'],
+        initial_levels=summary['initial_levels'],
+        final_levels=summary['final_levels'],
+        trade_log=trades,
+        level_history=summary['level_history'],
+        equity=equity_curve(n, trades, cfg.investment),
+        final_capital=summary['capital'],
+        cumulative_pnl=summary['cumulative_pnl'],
+        total_costs=summary['total_costs'],
+        total_brokerage=summary['total_brokerage'],
+    )
@@ -0,0 +1,461 @@
+import json
+import os
+import threading
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_STORE_ROOT = os.environ.get(
+    "TRADEGANN_BAR_STORE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bar_store"),
+)
+
+
+def _naive(ts):
+    """Wall-clock timestamp without timezone, used for range bookkeeping"""
+    ts = pd.Timestamp(ts)
+    return ts.tz_localize(None) if ts.tzinfo is not None else ts
+
+
+NS_PER_DAY = 86_400_000_000_000
+
+# Fixed-width on-disk record: one bar per 40 bytes, readable with numpy.memmap
+BAR_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f4'),
+    ('high', '<f4'),
+    ('low', '<f4'),
+    ('close', '<f4'),
+    ('volume', '<i8'),
+])
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# ==================== Compact bars ====================
+class Bars:
+    """
+    Compact OHLCV container: float32 open/high/low/close, int64 volume and int64
+    epoch-nanosecond (UTC) times, plus the exchange timezone used for display.
+    Roughly a third of the memory of a yfinance frame; slicing returns views.
+    """
+
+    __slots__ = ('time', 'open', 'high', 'low', 'close', 'volume', 'tz', '_index', '_days')
+
+    def __init__(self, time, open, high, low, close, volume, tz=None):
+        self.time = time
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.tz = tz
+        self._index = None
+        self._days = None
+
+    def __len__(self):
+        return len(self.time)
+
+    @property
+    def empty(self):
+        return len(self.time) == 0
+
+    def __getitem__(self, sl):
+        if not isinstance(sl, slice):
+            raise TypeError("Bars only supports slicing; index the column arrays for single bars")
+        return Bars(self.time[sl], self.open[sl], self.high[sl], self.low[sl],
+                    self.close[sl], self.volume[sl], self.tz)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, f).nbytes for f in ('time', 'open', 'high', 'low', 'close', 'volume'))
+
+    @property
+    def index(self):
+        """Bar timestamps as a DatetimeIndex in the exchange timezone (built once, on demand)"""
+        if self._index is None:
+            index = pd.DatetimeIndex(self.time.view('datetime64[ns]'))
+            self._index = index.tz_localize('UTC').tz_convert(self.tz) if self.tz else index
+        return self._index
+
+    @property
+    def days(self):
+        """Exchange-local calendar day of each bar as an integer day number (built once, on demand)"""
+        if self._days is None:
+            index = self.index
+            wall = index.tz_localize(None) if index.tz is not None else index
+            self._days = wall.asi8 // NS_PER_DAY
+        return self._days
+
+    def _bound(self, ts, side):
+        """Position of a wall-clock (or tz-aware) timestamp within `time`"""
+        ts = pd.Timestamp(ts)
+        if self.tz is not None:
+            ts = ts.tz_localize(self.tz) if ts.tzinfo is None else ts
+        return int(np.searchsorted(self.time, ts.as_unit('ns').value, side=side))
+
+    def between(self, start=None, end=None):
+        """View of the bars in [start, end)"""
+        lo = 0 if start is None else self._bound(start, 'left')
+        hi = len(self) if end is None else self._bound(end, 'left')
+        return self[lo:hi]
+
+    @classmethod
+    def empty_bars(cls, tz=None):
+        f = np.empty(0, dtype=np.float32)
+        i = np.empty(0, dtype=np.int64)
+        return cls(i, f, f, f, f, i, tz)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """Build from a history()-style DataFrame; extra columns such as Dividends are dropped"""
+        if frame.empty:
+            return cls.empty_bars()
+        index = frame.index
+        tz = index.tz
+        utc = index.tz_convert('UTC') if tz is not None else index
+        volume = frame['Volume'].to_numpy(dtype=np.float64, na_value=0) if 'Volume' in frame else np.zeros(len(frame))
+        return cls(
+            np.ascontiguousarray(utc.as_unit('ns').asi8),
+            np.ascontiguousarray(frame['Open'].to_numpy(dtype=np.float32)),
+            np.ascontiguousarray(frame['High'].to_numpy(dtype=np.float32)),
+            np.ascontiguousarray(frame['Low'].to_numpy(dtype=np.float32)),
+            np.ascontiguousarray(frame['Close'].to_numpy(dtype=np.float32)),
+            volume.astype(np.int64),
+            None if tz is None else str(tz),
+        )
+
+    @classmethod
+    def from_arrow(cls, table, time_column):
+        """
+        Build from an Arrow table read from the bar store. Time and volume columns are
+        taken without copying when they are single-chunk int64/timestamp[ns]; price
+        columns are downcast to float32 once.
+        """
+        times = table.column(time_column)
+        tz = times.type.tz
+        if times.type.unit != 'ns':
+            times = times.cast(pa.timestamp('ns', tz=tz))
+
+        def column(name, dtype):
+            col = table.column(name).combine_chunks() if name in table.column_names else None
+            if col is None:
+                return np.zeros(len(table), dtype=dtype)
+            values = col.to_numpy(zero_copy_only=False)
+            return values if values.dtype == dtype else values.astype(dtype)
+
+        time_values = times.combine_chunks().to_numpy(zero_copy_only=False).view(np.int64)
+        return cls(
+            time_values,
+            column('Open', np.float32),
+            column('High', np.float32),
+            column('Low', np.float32),
+            column('Close', np.float32),
+            column('Volume', np.int64),
+            tz,
+        )
+
+    @classmethod
+    def from_records(cls, records, tz=None):
+        """View a BAR_DTYPE record array (e.g. a memmap) as Bars without copying"""
+        if len(records) == 0:
+            return cls.empty_bars(tz)
+        return cls(records['time'], records['open'], records['high'], records['low'],
+                   records['close'], records['volume'], tz)
+
+    def to_records(self):
+        records = np.empty(len(self), dtype=BAR_DTYPE)
+        for name in BAR_DTYPE.names:
+            records[name] = getattr(self, name)
+        return records
+
+    def to_frame(self):
+        """OHLCV DataFrame (float64 prices) for code that still needs pandas"""
+        return pd.DataFrame({
+            'Open': self.open.astype(np.float64),
+            'High': self.high.astype(np.float64),
+            'Low': self.low.astype(np.float64),
+            'Close': self.close.astype(np.float64),
+            'Volume': self.volume,
+        }, index=self.index)
+
+
+# ==================== Shared-memory bars ====================
+@dataclass(frozen=True)
+class SharedBarsHandle:
+    """Picklable reference to bars held in shared memory: a few dozen bytes whatever the bar count"""
+
+    name: str
+    length: int
+    tz: str = None
+
+
+class SharedBars:
+    """
+    Bars copied once into a multiprocessing.shared_memory block as BAR_DTYPE records.
+    Pass `handle` to other processes and attach there with attach_shared_bars(): every
+    process then reads the same physical pages, so worker RSS does not grow with the data.
+    The creating process owns the block; close() unlinks it (also on leaving a with-block).
+    """
+
+    def __init__(self, bars):
+        records = bars.to_records()
+        # A zero-size block is not allowed; empty bars still get one byte
+        self._shm = shared_memory.SharedMemory(create=True, size=max(records.nbytes, 1))
+        np.ndarray(len(records), dtype=BAR_DTYPE, buffer=self._shm.buf)[:] = records
+        self.handle = SharedBarsHandle(self._shm.name, len(records), bars.tz)
+
+    def close(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Blocks this process has attached, kept open for as long as Bars may view them
+_attached_blocks = {}
+
+
+def attach_shared_bars(handle):
+    """Bars viewing the shared block behind `handle`, without copying"""
+    block = _attached_blocks.get(handle.name)
+    if block is None:
+        block = _attached_blocks[handle.name] = shared_memory.SharedMemory(name=handle.name)
+    records = np.ndarray(handle.length, dtype=BAR_DTYPE, buffer=block.buf)
+    records.flags.writeable = False
+    return Bars.from_records(records, handle.tz)
+
+
+# ==================== On-disk OHLCV store ====================
+class BarStore:
+    """
+    Parquet OHLCV store partitioned as <root>/<SYMBOL>/<interval>/bars.parquet.
+    ranges.json next to each partition lists the half-open [start, end) wall-clock
+    ranges already downloaded, so only the gaps of a request hit the network.
+    Each partition also keeps bars.bin, the same bars as fixed-width BAR_DTYPE records
+    (timezone in meta.json). read_bars() maps it with numpy.memmap, so processes share
+    the pages through the OS page cache and a date-range slice reads nothing up front.
+    """
+
+    def __init__(self, root=DEFAULT_STORE_ROOT):
+        self.root = root
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _dir(self, symbol, interval):
+        return os.path.join(self.root, symbol.upper().replace("/", "_"), interval)
+
+    def _bars_path(self, symbol, interval):
+        return os.path.join(self._dir(symbol, interval), "bars.parquet")
+
+    def _bin_path(self, symbol, interval):
+        return os.path.join(self._dir(symbol, interval), "bars.bin")
+
+    def _meta_path(self, symbol, interval):
+        return os.path.join(self._dir(symbol, interval), "meta.json")
+
+    def _ranges_path(self, symbol, interval):
+        return os.path.join(self._dir(symbol, interval), "ranges.json")
+
+    def _lock(self, symbol, interval):
+        """Per-partition lock, so loads of different symbols/intervals proceed in parallel"""
+        key = (symbol.upper(), interval)
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.RLock()
+            return lock
+
+    # ---------- Range bookkeeping ----------
+    def covered_ranges(self, symbol, interval):
+        path = self._ranges_path(symbol, interval)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            raw = json.load(f)
+        return [(pd.Timestamp(s), pd.Timestamp(e)) for s, e in raw]
+
+    def missing_ranges(self, symbol, interval, start, end):
+        """Sub-ranges of [start, end) that are not yet held locally"""
+        start, end = _naive(start), _naive(end)
+        gaps = []
+        cursor = start
+        for have_start, have_end in self.covered_ranges(symbol, interval):
+            if have_end <= cursor:
+                continue
+            if have_start >= end:
+                break
+            if have_start > cursor:
+                gaps.append((cursor, have_start))
+            cursor = max(cursor, have_end)
+            if cursor >= end:
+                break
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _write_ranges(self, symbol, interval, ranges):
+        path = self._ranges_path(symbol, interval)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump([[str(s), str(e)] for s, e in _merge_ranges(ranges)], f)
+        os.replace(tmp, path)
+
+    # ---------- Bars ----------
+    def read(self, symbol, interval, start=None, end=None):
+        path = self._bars_path(symbol, interval)
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        bars = pd.read_parquet(path)
+        if start is None and end is None:
+            return bars
+        wall = bars.index.tz_localize(None) if bars.index.tz is not None else bars.index
+        mask = np.ones(len(bars), dtype=bool)
+        if start is not None:
+            mask &= wall >= _naive(start)
+        if end is not None:
+            mask &= wall < _naive(end)
+        return bars[mask]
+
+    def _read_parquet_bars(self, symbol, interval):
+        """Compact Bars read straight from the Arrow columns of bars.parquet"""
+        path = self._bars_path(symbol, interval)
+        schema = pq.read_schema(path)
+        time_column = schema.pandas_metadata['index_columns'][0]
+        columns = [c for c in ('Open', 'High', 'Low', 'Close', 'Volume') if c in schema.names]
+        return Bars.from_arrow(pq.read_table(path, columns=columns + [time_column]), time_column)
+
+    def _write_bin(self, symbol, interval, bars):
+        """Rewrite bars.bin/meta.json; readers holding the old mapping keep the old file"""
+        for path, write in (
+            (self._bin_path(symbol, interval), lambda f: bars.to_records().tofile(f)),
+            (self._meta_path(symbol, interval), lambda f: f.write(json.dumps({"tz": bars.tz}).encode())),
+        ):
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+
+    def open_bars(self, symbol, interval):
+        """
+        Whole partition as memory-mapped Bars. Partitions written before bars.bin
+        existed are converted from Parquet on first use.
+        """
+        bin_path = self._bin_path(symbol, interval)
+        if not os.path.exists(bin_path):
+            if not os.path.exists(self._bars_path(symbol, interval)):
+                return Bars.empty_bars()
+            with self._lock(symbol, interval):
+                if not os.path.exists(bin_path):
+                    self._write_bin(symbol, interval, self._read_parquet_bars(symbol, interval))
+        with open(self._meta_path(symbol, interval)) as f:
+            tz = json.load(f)["tz"]
+        if os.path.getsize(bin_path) == 0:
+            return Bars.empty_bars(tz)
+        return Bars.from_records(np.memmap(bin_path, dtype=BAR_DTYPE, mode="r"), tz)
+
+    def read_bars(self, symbol, interval, start=None, end=None):
+        """Compact Bars for [start, end): a view into the memory-mapped partition"""
+        return self.open_bars(symbol, interval).between(start, end)
+
+    def write(self, symbol, interval, bars, start, end):
+        """Merge `bars` into the partition and record [start, end) as held (empty ranges are not recorded)"""
+        with self._lock(symbol, interval):
+            os.makedirs(self._dir(symbol, interval), exist_ok=True)
+            existing = self.read(symbol, interval)
+            if not bars.empty:
+                if not existing.empty:
+                    bars = pd.concat([existing, bars])
+                    bars = bars[~bars.index.duplicated(keep="last")].sort_index()
+                # Keep nanosecond timestamps on disk so read_bars can view them as int64 directly
+                bars = bars.set_axis(bars.index.as_unit('ns'))
+                path = self._bars_path(symbol, interval)
+                tmp = path + ".tmp"
+                bars.to_parquet(tmp)
+                os.replace(tmp, path)
+                self._write_bin(symbol, interval, Bars.from_frame(bars))
+            start, end = _naive(start), _naive(end)
+            if end > start:
+                ranges = self.covered_ranges(symbol, interval)
+                ranges.append((start, end))
+                self._write_ranges(symbol, interval, ranges)
+
+    def load(self, symbol, interval, start, end, fetch):
+        """
+        Return bars for [start, end), calling fetch(gap_start, gap_end) only for gaps.
+        Fetch errors are swallowed so locally held data is still served offline.
+        """
+        with self._lock(symbol, interval):
+            self.ensure(symbol, interval, start, end, fetch)
+            return self.read(symbol, interval, start, end)
+
+    def load_bars(self, symbol, interval, start, end, fetch):
+        """Same as load() but returns compact Bars instead of a DataFrame"""
+        with self._lock(symbol, interval):
+            self.ensure(symbol, interval, start, end, fetch)
+            return self.read_bars(symbol, interval, start, end)
+
+    def ensure(self, symbol, interval, start, end, fetch):
+        """
+        Download and store whatever part of [start, end) is not held yet. Only what a
+        fetch provably covered is recorded as held: up to the day of the last bar
+        returned, or, for an empty answer, a span without weekdays. Anything else
+        (yfinance answers network errors with an empty frame, and a weekday holiday
+        looks the same) is left missing and asked for again next time.
+        """
+        start, end = _naive(start), _naive(end)
+        # Never mark today's still-forming session as held
+        settled_end = min(end, pd.Timestamp.now().normalize())
+        with self._lock(symbol, interval):
+            has_local = os.path.exists(self._bars_path(symbol, interval))
+            for gap_start, gap_end in self.missing_ranges(symbol, interval, start, end):
+                try:
+                    fetched = fetch(gap_start, gap_end)
+                except Exception:
+                    continue
+                if fetched.empty:
+                    # With nothing stored an empty answer is more likely a bad symbol than a holiday
+                    if not has_local or not _non_trading_span(gap_start, gap_end):
+                        continue
+                    held_end = gap_end
+                else:
+                    held_end = min(gap_end, _naive(fetched.index[-1]).normalize() + pd.Timedelta(days=1))
+                self.write(symbol, interval, fetched, gap_start, min(held_end, settled_end))
+                has_local = True
+
+
+def _non_trading_span(start, end):
+    """True when [start, end) holds no weekday"""
+    last_day = (end - pd.Timedelta(1)).normalize()
+    return np.busday_count(start.date(), (last_day + pd.Timedelta(days=1)).date()) == 0
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_bar_store():
+    """Process-wide BarStore rooted at DEFAULT_STORE_ROOT"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = BarStore()
+        return _default_store
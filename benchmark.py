@@ -0,0 +1,114 @@
+"""
+Backtest kernel benchmark on a year of synthetic 5-minute bars:
+BacktestEngine.run (array kernel) against run_reference, the bar loop the
+Simulation tab ran before the kernel. Trades are checked for identity before
+anything is timed; the full equivalence check is test_backtest.py.
+
+The kernel skips flat bars but still runs scalar code per trade, so its time
+grows with the trade count. The 50x target over the bar loop is not met: the
+speedup is roughly 8-14x with a hundred or so trades and under 2x with
+thousands (Position/Swing, Immediate Entry, Long). The last line says how many
+configurations reached it.
+
+    python benchmark.py [--days 250] [--repeat 5]
+
+With --symbols N it times run_portfolio instead, on N synthetic symbols sharing
+one pool of capital (e.g. --symbols 20 --days 60).
+"""
+import argparse
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest import BacktestConfig, BacktestEngine
+from bar_store import Bars
+from portfolio import run_portfolio
+
+BARS_PER_DAY = 75   # 09:15-15:30 IST in 5-minute bars
+TARGET_SPEEDUP = 50
+
+
+def synthetic_bars(days=250, seed=7, price=1500.0):
+    """Seeded random-walk 5m bars on NSE hours"""
+    rng = np.random.default_rng(seed)
+    sessions = pd.bdate_range("2024-01-01", periods=days)
+    offsets = pd.to_timedelta(9 * 60 + 15 + 5 * np.arange(BARS_PER_DAY), unit="min")
+    index = pd.DatetimeIndex([d + off for d in sessions for off in offsets]).tz_localize("Asia/Kolkata")
+    n = len(index)
+    close = price * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    open_ = np.r_[price, close[:-1]] * (1 + rng.normal(0, 0.0005, n))
+    high = np.maximum(open_, close) * (1 + rng.random(n) * 0.002)
+    low = np.minimum(open_, close) * (1 - rng.random(n) * 0.002)
+    frame = pd.DataFrame({'Open': open_, 'High': high, 'Low': low, 'Close': close,
+                          'Volume': rng.integers(1_000, 50_000, n)}, index=index)
+    return Bars.from_frame(frame)
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def portfolio_benchmark(symbols, days, repeat):
+    """run_portfolio over `symbols` seeded random walks at different price levels"""
+    basket = {f"SYN{k}.NS": synthetic_bars(days, seed=k, price=100.0 + 137.0 * k) for k in range(symbols)}
+    print(f"{symbols} symbols x {days} days, {sum(len(b) for b in basket.values())} bars\n")
+    rows = []
+    for trade_type, entry_mode in itertools.product(["Intraday", "Position/Swing"], ["Wait for Level", "Immediate Entry"]):
+        config = BacktestConfig(trade_type=trade_type, entry_mode=entry_mode, investment=1_000_000.0)
+        cold_s = best_of(lambda: run_portfolio(basket, config), 1)
+        result = run_portfolio(basket, config)
+        rows.append({
+            'trade_type': trade_type, 'entry_mode': entry_mode, 'trades': len(result.trade_log),
+            'halted': result.halted_at is not None,
+            'first_run_ms': cold_s * 1000, 'best_ms': best_of(lambda: run_portfolio(basket, config), repeat) * 1000,
+        })
+    with pd.option_context('display.width', 140, 'display.float_format', '{:.1f}'.format):
+        print(pd.DataFrame(rows).to_string(index=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--symbols", type=int, default=0)
+    args = parser.parse_args()
+    if args.symbols:
+        return portfolio_benchmark(args.symbols, args.days, args.repeat)
+
+    bars = synthetic_bars(args.days)
+    print(f"{len(bars)} bars\n")
+
+    rows = []
+    grid = itertools.product(["Intraday", "Position/Swing"], ["Wait for Level", "Immediate Entry"], ["Long", "Short"])
+    for trade_type, entry_mode, position in grid:
+        engine = BacktestEngine(BacktestConfig(position=position, entry_mode=entry_mode, trade_type=trade_type,
+                                               max_total_loss_pct=100.0, tick=0.05))
+        fast, slow = engine.run(bars), engine.run_reference(bars)
+        if fast.trades != slow.trades or fast.final_capital != slow.final_capital:
+            raise SystemExit(f"Kernel and bar loop disagree: {trade_type} / {entry_mode} / {position}")
+        kernel_s = best_of(lambda: engine.run(bars), args.repeat)
+        loop_s = best_of(lambda: engine.run_reference(bars), args.repeat)
+        rows.append({
+            'trade_type': trade_type, 'entry_mode': entry_mode, 'position': position,
+            'trades': len(fast.trade_log),
+            'bar_loop_ms': loop_s * 1000, 'kernel_ms': kernel_s * 1000,
+            'speedup': loop_s / kernel_s,
+        })
+
+    table = pd.DataFrame(rows)
+    with pd.option_context('display.width', 140, 'display.float_format', '{:.1f}'.format):
+        print(table.to_string(index=False))
+    met = int((table['speedup'] >= TARGET_SPEEDUP).sum())
+    print(f"\n{TARGET_SPEEDUP}x target over the bar loop: met in {met} of {len(table)} configurations"
+          + ("" if met == len(table) else f", NOT met in {len(table) - met}"))
+
+
+if __name__ == "__main__":
+    main()
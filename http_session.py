@@ -0,0 +1,172 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from curl_cffi import CurlOpt
+    from curl_cffi import requests as curl_requests
+except ImportError:  # yfinance < 0.2.55 works with a plain requests session
+    curl_requests = None
+
+from telemetry import note_retry
+
+DEFAULT_POOL_SIZE = int(os.environ.get("TRADEGANN_HTTP_POOL", "16"))
+DEFAULT_RETRIES = int(os.environ.get("TRADEGANN_HTTP_RETRIES", "3"))
+
+
+# ==================== Session ====================
+class _CountingRetry(Retry):
+    """urllib3 retry policy that counts each retry against the telemetry span in progress"""
+
+    def increment(self, *args, **kwargs):
+        retry = super().increment(*args, **kwargs)
+        note_retry()
+        return retry
+
+
+if curl_requests is not None:
+    class _CountingCurlSession(curl_requests.Session):
+        """curl_cffi session that counts each of its own retries against the telemetry span in progress"""
+
+        def _retry_delay(self, attempt):
+            # Called once before every retry of a request
+            note_retry()
+            return super()._retry_delay(attempt)
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE, retries=DEFAULT_RETRIES):
+    """
+    Keep-alive HTTP session holding up to `pool_size` open connections. curl_cffi is
+    preferred because current yfinance requires it to pass Yahoo's browser checks.
+    Transport errors are retried inside the session with jittered exponential backoff,
+    which also covers requests whose errors yfinance logs instead of raising; each of
+    those retries is counted in telemetry like call_with_retry's own.
+    """
+    if curl_requests is not None:
+        return _CountingCurlSession(
+            impersonate="chrome",
+            curl_options={CurlOpt.MAXCONNECTS: pool_size},
+            retry=curl_requests.RetryStrategy(count=retries, delay=0.5, jitter=0.5, backoff="exponential"),
+        )
+    session = requests.Session()
+    retry = _CountingRetry(
+        total=retries, backoff_factor=0.5, backoff_jitter=0.5,
+        status_forcelist=(429, 500, 502, 503, 504), allowed_methods=None,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# ==================== Circuit breaker ====================
+class CircuitOpenError(Exception):
+    """Raised instead of calling out while the breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds; then lets a single trial call through (half-open),
+    closing again on success and re-opening on failure.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_running:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_running:
+                    self.trips += 1
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+# ==================== Retry ====================
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_retry(fn, *args, retries=None, breaker=None, fatal=(), **kwargs):
+    """
+    Call fn(*args, **kwargs), retrying failures with jittered backoff. Exceptions in
+    `fatal` (e.g. an unknown ticker) are raised at once and do not count against the
+    breaker. Returns (result, retries_used).
+    """
+    retries = DEFAULT_RETRIES if retries is None else retries
+    breaker = get_breaker() if breaker is None else breaker
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError("Market data source is failing; requests paused for a few seconds")
+        try:
+            result = fn(*args, **kwargs)
+        except fatal:
+            breaker.record_success()
+            raise
+        except Exception:
+            breaker.record_failure()
+            if attempt >= retries:
+                raise
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            note_retry()
+            continue
+        breaker.record_success()
+        return result, attempt
+
+
+_session = None
+_breaker = CircuitBreaker()
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide pooled session shared by every data fetch"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+def get_breaker():
+    return _breaker
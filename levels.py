@@ -0,0 +1,238 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
+
+import numpy as np
+
+
+def round_prices(values, decimals=2):
+    """
+    np.round that agrees exactly with Python's round(): the two only disagree on
+    values within float error of a half-cent, and those few are rounded by Python.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.round(values, decimals)
+    scaled = values * 10.0 ** decimals
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if near_tie.any():
+        out[near_tie] = [round(v, decimals) for v in values[near_tie].tolist()]
+    return out
+
+
+# ==================== Level specification ====================
+@dataclass(frozen=True)
+class LevelSpec:
+    """
+    Square-of-9 geometry. One full turn of the square (360°) adds 2 to the square
+    root of price, so an angle of a° is a step of a/180 in sqrt units.
+    Defaults reproduce the classic levels: entries 15° (1/12) either side of the
+    anchor, targets every 20° (k/9), and S/R at 0.5/1.0/1.5 around ceil(sqrt(anchor)).
+    """
+
+    entry_angle: float = 15.0
+    target_angle: float = 20.0
+    num_targets: int = 9
+    sr_offsets: tuple = (0.5, 1.0, 1.5)
+
+    def __post_init__(self):
+        if self.entry_angle <= 0 or self.target_angle <= 0:
+            raise ValueError("Entry and target angles must be positive")
+        if self.num_targets < 3:
+            raise ValueError("At least 3 targets are needed")
+        if len(self.sr_offsets) < 3 or any(o <= 0 for o in self.sr_offsets):
+            raise ValueError("At least 3 positive support/resistance offsets are needed")
+        object.__setattr__(self, 'sr_offsets', tuple(float(o) for o in self.sr_offsets))
+
+
+DEFAULT_LEVEL_SPEC = LevelSpec()
+
+
+@lru_cache(maxsize=64)
+def compile_level_spec(spec):
+    """Offset vectors (in sqrt-of-price units) for `spec`, shaped to broadcast over (n, 1) anchors"""
+    return {
+        "entry": spec.entry_angle / 180,
+        "targets": ((np.arange(1, spec.num_targets + 1) * spec.target_angle) / 180)[None, :],
+        "sr": np.array(spec.sr_offsets)[None, :],
+    }
+
+
+# ==================== Batch levels ====================
+def calculate_levels_batch(prices, spec=DEFAULT_LEVEL_SPEC):
+    """
+    Square-of-9 levels for an array of anchor prices, computed with broadcasting.
+    Returns a dict of arrays: buy/sell/breakout have shape (n,), bull_targets and
+    bear_targets (n, spec.num_targets), resistances and supports (n, len(spec.sr_offsets)).
+    """
+    offsets = compile_level_spec(spec)
+    prices = np.asarray(prices, dtype=np.float64).reshape(-1)
+    buy, sell = entry_levels_batch(prices, spec)
+    s = np.sqrt(prices)[:, None]
+    b = np.ceil(s)
+
+    return {
+        "buy": buy,
+        "sell": sell,
+        "bull_targets": round_prices((s + offsets["targets"])**2),
+        "bear_targets": round_prices((s - offsets["targets"])**2),
+        "breakout": round_prices(b[:, 0]**2),
+        "resistances": round_prices((b + offsets["sr"])**2),
+        "supports": round_prices((b - offsets["sr"])**2),
+    }
+
+
+def entry_levels_batch(prices, spec=DEFAULT_LEVEL_SPEC):
+    """Just the buy and sell levels of calculate_levels_batch, for scanning long price series"""
+    s = np.sqrt(np.asarray(prices, dtype=np.float64).reshape(-1))
+    entry = compile_level_spec(spec)["entry"]
+    return round_prices((s + entry)**2), round_prices((s - entry)**2)
+
+
+def levels_at(batch, i):
+    """Row `i` of a calculate_levels_batch result in the scalar dict-of-lists form"""
+    return {
+        "buy": float(batch["buy"][i]),
+        "sell": float(batch["sell"][i]),
+        "bull_targets": batch["bull_targets"][i].tolist(),
+        "bear_targets": batch["bear_targets"][i].tolist(),
+        "breakout": float(batch["breakout"][i]),
+        "resistances": batch["resistances"][i].tolist(),
+        "supports": batch["supports"][i].tolist(),
+    }
+
+
+def calculate_levels(price: float, spec=DEFAULT_LEVEL_SPEC):
+    """Square-of-9 levels for one anchor price (thin wrapper over calculate_levels_batch)"""
+    return levels_at(calculate_levels_batch([price], spec), 0)
+
+
+# ==================== Memoized level table ====================
+def tick_size(symbol):
+    """Minimum price increment used to key cached levels: 0.05 on NSE/BSE, 0.01 elsewhere"""
+    return 0.05 if symbol and symbol.upper().endswith(('.NS', '.BO')) else 0.01
+
+
+def _freeze(levels):
+    return MappingProxyType({k: tuple(v) if isinstance(v, list) else v for k, v in levels.items()})
+
+
+def round_to_tick(prices, tick=0.01):
+    """Anchor prices as LevelTable computes levels from them: whole ticks, then cents"""
+    return round_prices(np.rint(np.asarray(prices, dtype=np.float64) / tick) * tick)
+
+
+class LevelTable:
+    """
+    Bounded LRU of Square-of-9 levels keyed by the anchor price in whole ticks, so
+    anchors that differ by less than half a tick share one entry. Levels are computed
+    from the tick-rounded anchor and returned as read-only mappings with tuple values,
+    safe to share between sessions; take list(...) of a value to modify it.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, price, tick=0.01, spec=DEFAULT_LEVEL_SPEC):
+        ticks = int(round(price / tick))
+        key = (ticks, tick, spec)
+        with self._lock:
+            levels = self._data.get(key)
+            if levels is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return levels
+            self.misses += 1
+        levels = _freeze(calculate_levels(round(ticks * tick, 2), spec))
+        with self._lock:
+            self._data[key] = levels
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return levels
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_level_table = LevelTable()
+
+
+def cached_levels(price, tick=0.01, spec=DEFAULT_LEVEL_SPEC):
+    """Memoized, read-only calculate_levels for `price` rounded to `tick`"""
+    return _level_table.get(price, tick, spec)
+
+
+def level_table_stats():
+    return _level_table.stats()
+
+
+# ==================== Level crossing index ====================
+def first_cross_above(high, levels, start=0):
+    """
+    Index of the first bar at or after `start` whose high reaches each level
+    (high >= level); len(high) where it never does. One cumulative max plus a
+    searchsorted answers any number of levels.
+    """
+    high = np.asarray(high, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    running_high = np.maximum.accumulate(high[start:])
+    return start + np.searchsorted(running_high, levels, side="left")
+
+
+def first_cross_below(low, levels, start=0):
+    """Index of the first bar at or after `start` with low <= level; len(low) where it never does"""
+    low = np.asarray(low, dtype=np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    # Negated running minimum is non-decreasing, so it can be searched like the running high
+    running_low = -np.minimum.accumulate(low[start:])
+    return start + np.searchsorted(running_low, -levels, side="left")
+
+
+def first_touch(high, low, levels, start=0):
+    """
+    Index of the first bar at or after `start` whose range contains each level
+    (low <= level <= high); len(high) where none does. A touching bar can come no
+    earlier than both the first cross above and the first cross below; if the bar
+    there gapped over the level the search resumes after it, which is rare.
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    levels = np.atleast_1d(np.asarray(levels, dtype=np.float64))
+    n = len(high)
+    if len(levels) == 1:
+        # One level: a single masked scan beats the cross-and-retry search
+        inside = (low[start:] <= levels[0]) & (levels[0] <= high[start:])
+        k = int(inside.argmax()) if len(inside) else 0
+        return np.array([start + k if len(inside) and inside[k] else n], dtype=np.int64)
+    result = np.full(len(levels), n, dtype=np.int64)
+    pending = np.arange(len(levels))
+    starts = np.full(len(levels), start, dtype=np.int64)
+    while len(pending):
+        for begin in np.unique(starts[pending]):
+            group = pending[starts[pending] == begin]
+            if begin >= n:
+                starts[group] = n
+                continue
+            candidate = np.maximum(
+                first_cross_above(high, levels[group], begin),
+                first_cross_below(low, levels[group], begin),
+            )
+            starts[group] = candidate
+            inside = candidate < n
+            hit = np.zeros(len(group), dtype=bool)
+            hit[inside] = (low[candidate[inside]] <= levels[group][inside]) & (levels[group][inside] <= high[candidate[inside]])
+            result[group[hit]] = candidate[hit]
+            # Gapped over: retry from the next bar
+            starts[group[inside & ~hit]] += 1
+            starts[group[~inside]] = n
+        pending = pending[(result[pending] == n) & (starts[pending] < n)]
+    return result
@@ -1,9 +1,7 @@
 # Last updated: Paper Trading Tab Fixed - Removed blocking time.sleep() and debug messages
 import streamlit as st
-import math
 import numpy as np
 import matplotlib.pyplot as plt
-import yfinance as yf
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import pandas as pd
@@ -11,31 +9,28 @@ from datetime import datetime, timedelta, time as dt_time
 import time
 import threading
 import json
+import os
+import uuid
 
-# ==================== Core math ====================
-def calculate_levels(price: float):
-    s = math.sqrt(price)
-
-    buy = round((s + 1/12)**2, 2)
-    sell = round((s - 1/12)**2, 2)
-
-    bull_targets = [round((s + k/9)**2, 2) for k in range(1, 10)]
-    bear_targets = [round((s - k/9)**2, 2) for k in range(1, 10)]
-
-    b = math.ceil(s)
-    breakout = round(b**2, 2)
-    resistances = [round((b + x)**2, 2) for x in (0.5, 1.0, 1.5)]
-    supports = [round((b - x)**2, 2) for x in (0.5, 1.0, 1.5)]
+from backtest import BacktestConfig, BacktestEngine, calculate_trading_costs
+from bar_store import Bars
+from http_session import get_breaker
+from levels import DEFAULT_LEVEL_SPEC, LevelSpec, cached_levels, level_table_stats, tick_size
+from market_data import (
+    fetch_bars_range, fetch_history, fetch_stats, format_age, get_provider, get_quote, get_scheduler,
+    last_close, start_warmup, submit_fetch
+)
+from portfolio import run_portfolio
+from sweep import DEFAULT_WORKERS, max_drawdown_pct, rank_results, run_sweep as run_parameter_sweep
+from symbols import get_symbol_master
+from telemetry import get_telemetry, set_screen
 
-    return {
-        "buy": buy,
-        "sell": sell,
-        "bull_targets": bull_targets,
-        "bear_targets": bear_targets,
-        "breakout": breakout,
-        "resistances": resistances,
-        "supports": supports,
-    }
+SWEEP_RANK_LABELS = {
+    'return_pct': "Return %",
+    'win_rate': "Win rate",
+    'max_drawdown_pct': "Max drawdown (lowest first)",
+    'total_costs': "Costs (lowest first)",
+}
 
 # ==================== Risk to Reward helpers ====================
 def rr_long(entry, stop, targets):
@@ -46,39 +41,6 @@ def rr_short(entry, stop, targets):
     risk = max(stop - entry, 1e-9)
     return [round(max(entry - t, 0.0) / risk, 2) for t in targets]
 
-# ==================== Trading Cost Calculation ====================
-def calculate_trading_costs(entry_price, exit_price, quantity, brokerage_per_order, stt_pct, txn_charges_pct, gst_pct):
-    """
-    Calculate total trading costs including brokerage, STT, transaction charges, and GST
-    """
-    turnover = (entry_price + exit_price) * quantity
-    
-    # Brokerage (buy + sell)
-    brokerage_buy = brokerage_per_order
-    brokerage_sell = brokerage_per_order
-    total_brokerage = brokerage_buy + brokerage_sell
-    
-    # STT (only on sell side for equity delivery/intraday)
-    stt = (exit_price * quantity) * (stt_pct / 100)
-    
-    # Transaction charges (both sides)
-    txn_charges = turnover * (txn_charges_pct / 100)
-    
-    # GST on brokerage and transaction charges
-    gst_base = total_brokerage + txn_charges
-    gst = gst_base * (gst_pct / 100)
-    
-    # Total costs
-    total_cost = total_brokerage + stt + txn_charges + gst
-    
-    return {
-        'brokerage': total_brokerage,
-        'stt': stt,
-        'transaction_charges': txn_charges,
-        'gst': gst,
-        'total': total_cost
-    }
-
 # ==================== Donut chart ====================
 def donut_chart(values, labels, center_label, cmap_name):
     fig, ax = plt.subplots(figsize=(5, 5), facecolor='white')
@@ -129,6 +91,42 @@ POPULAR_STOCKS_US = [
     "JNJ", "PG", "MA", "UNH", "HD", "DIS", "NFLX", "BAC", "KO", "PFE"
 ]
 
+# Keep last-day quotes for the popular lists cached so the first pick of any of them is instant
+start_warmup([POPULAR_STOCKS_INDIA, POPULAR_STOCKS_US])
+
+
+def resolve_symbol_input(text):
+    """
+    Check a typed ticker against the local symbol master and render the outcome below the input.
+    Returns the Yahoo ticker to use (.NS/.BO added when missing), or "" when it cannot be a Yahoo
+    symbol so nothing is fetched for it. The lists themselves only advise: an unlisted ticker is
+    still fetched, since they miss ETFs, funds and OTC names.
+    """
+    if not text or not text.strip():
+        return ""
+    master = get_symbol_master()
+    ticker, status = master.resolve(text)
+    market = master.market_of(ticker)
+    unlisted = status == 'unknown' and market is not None and master.covers(market)
+    if status == 'invalid':
+        st.error(f"❌ **{ticker}** is not a valid ticker")
+    elif unlisted:
+        st.warning(f"⚠️ **{ticker}** is not in the local symbol lists; fetching it anyway")
+    if status == 'invalid' or unlisted:
+        # Offer completions of the longest prefix that still matches something
+        base = ticker.split('.')[0]
+        matches = []
+        while base and not matches:
+            matches = master.complete(base)
+            base = base[:-1]
+        if matches:
+            st.caption("Did you mean: " + ", ".join(f"**{t}** ({name})" for t, name in matches))
+    if status == 'invalid':
+        return ""
+    if ticker != text.strip().upper():
+        st.caption(f"Using **{ticker}**")
+    return ticker
+
 st.markdown(
     """
     <style>
@@ -420,13 +418,114 @@ st.markdown(
     unsafe_allow_html=True,
 )
 
+# ==================== Level Geometry ====================
+def level_spec_editor():
+    """Sidebar editor for the Square-of-9 geometry used by every tab; invalid input falls back to the default"""
+    with st.sidebar.expander("📐 Level Geometry", expanded=False):
+        st.caption("One full turn of the square (360°) adds 2 to √price. Defaults are the classic levels.")
+        entry_angle = st.number_input("Entry angle (°)", min_value=1.0, max_value=180.0,
+                                      value=DEFAULT_LEVEL_SPEC.entry_angle, step=1.0, key="spec_entry_angle",
+                                      help="Buy/Sell levels sit this far either side of the anchor (15° = 1/12 in √price)")
+        target_angle = st.number_input("Target spacing (°)", min_value=1.0, max_value=180.0,
+                                       value=DEFAULT_LEVEL_SPEC.target_angle, step=1.0, key="spec_target_angle",
+                                       help="Distance between consecutive targets (20° = 1/9 in √price)")
+        num_targets = st.number_input("Number of targets", min_value=3, max_value=18,
+                                      value=DEFAULT_LEVEL_SPEC.num_targets, step=1, key="spec_num_targets")
+        sr_text = st.text_input("S/R offsets around ⌈√price⌉", value=", ".join(str(o) for o in DEFAULT_LEVEL_SPEC.sr_offsets),
+                                key="spec_sr_offsets", help="Comma-separated √price offsets for supports/resistances (at least 3)")
+        try:
+            return LevelSpec(
+                entry_angle=float(entry_angle),
+                target_angle=float(target_angle),
+                num_targets=int(num_targets),
+                sr_offsets=tuple(float(x) for x in sr_text.split(",") if x.strip()),
+            )
+        except ValueError as e:
+            st.error(f"❌ {e}. Using the default geometry.")
+            return DEFAULT_LEVEL_SPEC
+
+
+level_spec = level_spec_editor()
+
 # ==================== Tab Navigation ====================
-tab1, tab2, tab3, tab4 = st.tabs(["📊 Calculator", "🎮 Simulation", "📈 Paper Trading", "📋 Reports"])
+# The diagnostics tab is hidden unless the URL has ?diagnostics=1 or TRADEGANN_DIAGNOSTICS=1 is set
+show_diagnostics = st.query_params.get("diagnostics") == "1" or os.environ.get("TRADEGANN_DIAGNOSTICS") == "1"
+tab_names = ["📊 Calculator", "🎮 Simulation", "📈 Paper Trading", "📋 Reports"]
+if show_diagnostics:
+    tab_names.append("🩺 Diagnostics")
+tab1, tab2, tab3, tab4, *diagnostics_tab = st.tabs(tab_names)
+
+# ====================================
+# TAB 5: DIAGNOSTICS (hidden)
+# ====================================
+# Rendered before the other tabs so an st.stop() in one of them cannot hide it;
+# it shows the calls recorded up to the start of this rerun
+if diagnostics_tab:
+    with diagnostics_tab[0]:
+        set_screen("Diagnostics")
+        st.header("🩺 Data-Fetch Diagnostics")
+        st.caption("Per-call telemetry of the market data layer since the server started (latest 10,000 calls kept), as of the start of this rerun.")
+        
+        telemetry = get_telemetry()
+        events = telemetry.to_frame()
+        cache_stats = fetch_stats()
+        breaker = get_breaker()
+        
+        col_d1, col_d2, col_d3, col_d4 = st.columns(4)
+        with col_d1:
+            st.metric("Calls Recorded", len(events))
+        with col_d2:
+            lookups = cache_stats['cache_hits'] + cache_stats['cache_misses']
+            st.metric("Cache Hit Rate", f"{cache_stats['cache_hits'] / lookups:.0%}" if lookups else "—")
+        with col_d3:
+            st.metric("Time in Fetches", f"{telemetry.busy_ms() / 1000:.1f}s")
+        with col_d4:
+            st.metric("Circuit Breaker", breaker.state.title(), f"{breaker.trips} trips", delta_color="off")
+        
+        if events.empty:
+            st.info("No data calls recorded yet. Use the other tabs, then come back here.")
+        else:
+            st.markdown("#### ⏱️ Latency Histogram")
+            histograms = telemetry.histogram_frame()
+            fig_latency = go.Figure()
+            for cache in histograms.columns:
+                fig_latency.add_trace(go.Bar(x=histograms.index, y=histograms[cache], name=cache))
+            fig_latency.update_layout(barmode='group', height=350, xaxis_title="Latency", yaxis_title="Calls")
+            st.plotly_chart(fig_latency, use_container_width=True)
+            
+            st.markdown("#### 💸 Costliest Screens and Symbols")
+            summary = telemetry.summary()
+            st.dataframe(summary, use_container_width=True, hide_index=True)
+            
+            st.markdown("#### 🧾 Recent Calls")
+            st.dataframe(events.iloc[::-1].head(200), use_container_width=True, hide_index=True)
+            
+            col_dl1, col_dl2 = st.columns(2)
+            with col_dl1:
+                st.download_button(
+                    label="💾 Download Calls (CSV)",
+                    data=events.to_csv(index=False),
+                    file_name="data_fetch_calls.csv",
+                    mime="text/csv",
+                    key="download_telemetry_events"
+                )
+            with col_dl2:
+                st.download_button(
+                    label="💾 Download Summary (CSV)",
+                    data=summary.to_csv(index=False),
+                    file_name="data_fetch_summary.csv",
+                    mime="text/csv",
+                    key="download_telemetry_summary"
+                )
+        
+        with st.expander("🔧 Cache and Scheduler Counters"):
+            st.json({'history_cache': cache_stats, 'level_table': level_table_stats(), 'scheduler': get_scheduler().stats()})
 
 # ====================================
 # TAB 1: CALCULATOR
 # ====================================
 with tab1:
+    set_screen("Calculator")
     # ==================== Input Row ====================
     st.markdown("### 📊 Select Stock or Enter Price")
 
@@ -467,8 +566,9 @@ with tab1:
                 "Enter Stock Symbol",
                 placeholder="e.g., AAPL, GOOGL, RELIANCE.NS, etc.",
                 key="calc_stock_custom",
-                help="Enter any valid stock ticker (add .NS for Indian stocks, .BO for BSE)"
+                help="Enter any valid stock ticker (.NS is added for NSE symbols typed without a suffix; use .BO for BSE)"
             )
+            custom_stock = resolve_symbol_input(custom_stock)
     
     # Determine which input changed and set selected_stock accordingly
     selected_stock = ""
@@ -503,19 +603,26 @@ with tab1:
     # Fetch price first if stock is selected
     price = 214.0  # Default price
     if selected_stock and selected_stock != "":
-        with st.spinner(f"Fetching live data for {selected_stock}..."):
-            try:
-                ticker = yf.Ticker(selected_stock)
-                hist = ticker.history(period="1d")
-                if not hist.empty:
-                    price = float(hist['Close'].iloc[-1])
-                    st.success(f"✅ Live Price Loaded: **{selected_stock}** = **₹{price:.2f}**")
-                else:
-                    st.warning(f"⚠️ Could not fetch data for **{selected_stock}**. Please check the ticker symbol.")
-                    st.info("💡 **Tip:** Indian stocks need .NS (NSE) or .BO (BSE) suffix. Example: RELIANCE.NS")
-            except Exception as e:
-                st.error(f"❌ Invalid stock symbol: **{selected_stock}**")
-                st.info("💡 **Common formats:** AAPL (US), RELIANCE.NS (Indian NSE), SBIN.BO (Indian BSE)")
+        # Known symbols answer from the quote cache instantly (refreshed in the background);
+        # only the first lookup of a symbol waits on the network
+        quote_price, quote_time = get_quote(selected_stock, block=False)
+        quote_error = False
+        if quote_price is None:
+            with st.spinner(f"Fetching live data for {selected_stock}..."):
+                try:
+                    quote_price, quote_time = get_quote(selected_stock)
+                except Exception as e:
+                    quote_error = True
+        
+        if quote_price is not None:
+            price = quote_price
+            st.success(f"✅ Live Price Loaded: **{selected_stock}** = **₹{price:.2f}** (updated {format_age(quote_time)} ago)")
+        elif quote_error:
+            st.error(f"❌ Invalid stock symbol: **{selected_stock}**")
+            st.info("💡 **Common formats:** AAPL (US), RELIANCE.NS (Indian NSE), SBIN.BO (Indian BSE)")
+        else:
+            st.warning(f"⚠️ Could not fetch data for **{selected_stock}**. Please check the ticker symbol.")
+            st.info("💡 **Tip:** Indian stocks need .NS (NSE) or .BO (BSE) suffix. Example: RELIANCE.NS")
     
     # Now create the number input with the fetched price
     with col_price:
@@ -532,7 +639,7 @@ with tab1:
     st.session_state.current_price = price
     st.session_state.current_stock = selected_stock if selected_stock else None
 
-    res = calculate_levels(price)
+    res = cached_levels(price, tick_size(selected_stock), level_spec)
     
     # Store in session state for simulation tab
     st.session_state.levels = res
@@ -693,6 +800,7 @@ with tab1:
 # TAB 2: SIMULATION
 # ====================================
 with tab2:
+    set_screen("Simulation")
     st.markdown("### 🎮 Backtest Your Strategy")
     st.markdown("Test how Square-of-9 levels would have performed on historical data")
     
@@ -751,6 +859,7 @@ with tab2:
                 key="sim_stock_custom",
                 help="Enter any valid stock ticker from any exchange"
             )
+            custom_sim_stock = resolve_symbol_input(custom_sim_stock)
     
     # Determine which input changed and set sim_stock accordingly
     sim_stock = ""
@@ -779,19 +888,10 @@ with tab2:
         elif custom_sim_stock:
             sim_stock = custom_sim_stock.upper()
     
+    # Start the reference-price lookup now; it is rendered once the parameter widgets are drawn
+    ref_price_future = submit_fetch(last_close, sim_stock) if sim_stock else None
     with col_price_display:
-        if sim_stock:
-            # Fetch current price for reference
-            try:
-                ticker = yf.Ticker(sim_stock)
-                current_data = ticker.history(period="1d")
-                if not current_data.empty:
-                    current_price = float(current_data['Close'].iloc[-1])
-                    st.metric("Current Price", f"₹{current_price:.2f}")
-                else:
-                    st.info("Price unavailable")
-            except:
-                st.info("Price unavailable")
+        ref_price_slot = st.empty()
     
     if not sim_stock:
         st.info("👆 Please select a stock to run the simulation")
@@ -809,17 +909,6 @@ with tab2:
         )
         st.stop()
     
-    # Show current price for reference only
-    try:
-        ticker = yf.Ticker(sim_stock)
-        current_hist = ticker.history(period="1d")
-        if not current_hist.empty:
-            current_ref_price = float(current_hist['Close'].iloc[-1])
-        else:
-            current_ref_price = None
-    except:
-        current_ref_price = None
-    
     st.markdown("<br>", unsafe_allow_html=True)
     
     # ==================== Simulation Inputs ====================
@@ -856,7 +945,7 @@ with tab2:
                 ["5m", "15m", "30m", "60m"],
                 index=1,
                 key="intraday_interval",
-                help="Smaller intervals = more trades but limited to last 60 days (yfinance restriction). 5m=5min, 15m=15min, 30m=30min, 60m=1hr"
+                help="Smaller intervals = more trades. Yahoo serves 5m-30m bars for the last 60 days and 60m bars for the last 730 days; long ranges are downloaded in parallel chunks and kept locally, so older bars stay available once fetched. 5m=5min, 15m=15min, 30m=30min, 60m=1hr"
             )
         else:
             st.write("**Select Date Range**")
@@ -1023,41 +1112,271 @@ with tab2:
     
     run_simulation = st.button("🚀 Run Simulation", type="primary", use_container_width=True)
     
-    st.markdown("---")
+    # Start every download for this run at once; they overlap with the rendering below
+    if run_simulation:
+        # Convert dates to datetime and add one day to end_date to include it
+        start_dt = pd.Timestamp(start_date)
+        end_dt = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+        if trade_type == "Intraday":
+            # For intraday, fetch with specified interval; levels anchor on each session's first bar
+            history_future = submit_fetch(fetch_bars_range, sim_stock, start_dt, end_dt, interval=intraday_interval)
+        else:
+            # For Position/Swing, use daily data
+            history_future = submit_fetch(fetch_bars_range, sim_stock, start_dt, end_dt)
     
+    # Show current price for reference only
+    try:
+        current_ref_price = ref_price_future.result()
+    except Exception:
+        current_ref_price = None
+    with ref_price_slot.container():
+        if current_ref_price is not None:
+            st.metric("Current Price", f"₹{current_ref_price:.2f}")
+        else:
+            st.info("Price unavailable")
+
+    st.markdown("---")
+
+    # ==================== Parameter Sweep ====================
+    with st.expander("🧪 Parameter Sweep", expanded=False):
+        st.caption("Backtests every combination of the values below across all CPU cores. "
+                   "Capital, max total loss, costs and dates come from the settings above.")
+        col_sw1, col_sw2, col_sw3 = st.columns(3)
+        with col_sw1:
+            sweep_risk = st.multiselect("Max Loss per Trade (%)", [0.5, 1.0, 1.5, 2.0, 3.0, 5.0],
+                                        default=[1.0, 2.0, 3.0], key="sweep_risk")
+            sweep_positions = st.multiselect("Position", ["Long", "Short"], default=["Long", "Short"],
+                                             key="sweep_positions")
+        with col_sw2:
+            sweep_entry_modes = st.multiselect("Entry Mode", ["Wait for Level", "Immediate Entry"],
+                                               default=["Wait for Level", "Immediate Entry"], key="sweep_entry_modes")
+            if trade_type == "Intraday":
+                sweep_intervals = st.multiselect("Time Interval", ["5m", "15m", "30m", "60m"],
+                                                 default=[intraday_interval], key="sweep_intervals")
+        with col_sw3:
+            sweep_rank = st.selectbox("Rank by", list(SWEEP_RANK_LABELS), format_func=SWEEP_RANK_LABELS.get,
+                                      key="sweep_rank")
+            sweep_workers = st.number_input("Worker processes", min_value=1, max_value=64,
+                                            value=min(DEFAULT_WORKERS, 64), key="sweep_workers")
+
+        sweep_grid = {'max_loss_pct': sweep_risk, 'entry_mode': sweep_entry_modes, 'position': sweep_positions}
+        if trade_type == "Intraday":
+            sweep_grid['interval'] = sweep_intervals
+        sweep_total = int(np.prod([len(v) for v in sweep_grid.values()]))
+
+        col_sw_run, col_sw_cancel = st.columns(2)
+        with col_sw_run:
+            run_sweep_clicked = st.button(f"🧪 Run Sweep ({sweep_total} runs)", use_container_width=True,
+                                          disabled=sweep_total == 0 or not sim_stock, key="run_sweep")
+        with col_sw_cancel:
+            # Any click reruns the script, which interrupts a sweep in progress; the pool is shut down on the way out
+            st.button("⏹️ Cancel Sweep", use_container_width=True, key="cancel_sweep")
+
+        if run_sweep_clicked:
+            start_dt = pd.Timestamp(start_date)
+            end_dt = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+            sweep_status = st.empty()
+            sweep_status.info("Fetching bars once for all runs...")
+            intervals = sweep_grid.get('interval', ['1d'])
+            futures = {iv: submit_fetch(fetch_bars_range, sim_stock, start_dt, end_dt,
+                                        **({} if iv == '1d' else {'interval': iv})) for iv in intervals}
+            sweep_bars = {}
+            for iv, future in futures.items():
+                try:
+                    bars = future.result()
+                except Exception:
+                    bars = Bars.empty_bars()
+                if not bars.empty:
+                    sweep_bars[iv] = bars
+            if 'interval' in sweep_grid:
+                sweep_grid['interval'] = [iv for iv in intervals if iv in sweep_bars]
+            if not sweep_bars:
+                sweep_status.error("❌ No historical data available for selected dates!")
+            else:
+                base_config = BacktestConfig(
+                    trade_type=trade_type,
+                    investment=investment,
+                    max_total_loss_pct=max_total_loss_pct,
+                    brokerage_per_trade=brokerage_per_trade,
+                    stt_rate=stt_rate,
+                    transaction_charges=transaction_charges,
+                    gst_rate=gst_rate,
+                    tick=tick_size(sim_stock),
+                    level_spec=level_spec,
+                )
+                st.session_state.sweep_rows = []
+                st.session_state.sweep_label = f"{sim_stock} • {trade_type} • {start_date} → {end_date}"
+                st.session_state.sweep_total = int(np.prod([len(v) for v in sweep_grid.values()]))
+                st.session_state.sweep_status = 'running'
+                sweep_progress = st.progress(0.0)
+                sweep_started = time.perf_counter()
+
+                def on_sweep_result(row, done, total):
+                    st.session_state.sweep_rows.append(row)
+                    sweep_progress.progress(done / total, text=f"{done}/{total} runs")
+
+                def sweep_tick():
+                    # Updating an element is also where Streamlit raises out of a run to
+                    # serve a Cancel click, so this keeps cancelling prompt between results
+                    sweep_status.info(f"⚙️ Sweeping on {sweep_workers} processes... "
+                                      f"{time.perf_counter() - sweep_started:.1f}s")
+                    return False
+
+                run_parameter_sweep(sweep_bars, base_config, sweep_grid, workers=int(sweep_workers),
+                                    on_result=on_sweep_result, should_stop=sweep_tick)
+                st.session_state.sweep_status = 'done'
+                sweep_status.success(f"✅ Sweep finished in {time.perf_counter() - sweep_started:.1f}s")
+
+        sweep_rows = st.session_state.get('sweep_rows')
+        if sweep_rows:
+            if st.session_state.get('sweep_status') != 'done':
+                st.warning(f"⏹️ Sweep stopped after {len(sweep_rows)} of {st.session_state.sweep_total} runs")
+            st.markdown(f"**Ranked results** — {st.session_state.sweep_label}")
+            sweep_df = rank_results(sweep_rows, by=sweep_rank).rename(columns={
+                'max_loss_pct': 'Risk %', 'entry_mode': 'Entry Mode', 'position': 'Position',
+                'interval': 'Interval', 'return_pct': 'Return %',
+                'win_rate': 'Win Rate %', 'max_drawdown_pct': 'Max Drawdown %', 'trades': 'Trades',
+                'total_costs': 'Costs (₹)', 'final_capital': 'Final Capital (₹)',
+            })
+            st.dataframe(sweep_df.round(2), use_container_width=True, hide_index=True)
+
+    # ==================== Portfolio Backtest ====================
+    with st.expander("📦 Portfolio Backtest", expanded=False):
+        st.caption("Runs the strategy above over a basket on one timeline with one pool of capital: "
+                   "each entry risks the Max Loss per Trade share of the shared capital, entries are limited "
+                   "to cash not tied up in open positions, and Max Total Loss stops the whole portfolio.")
+        portfolio_symbols = st.multiselect("Basket", POPULAR_STOCKS_INDIA, default=POPULAR_STOCKS_INDIA,
+                                           key="portfolio_symbols")
+        run_portfolio_clicked = st.button(f"📦 Run Portfolio Backtest ({len(portfolio_symbols)} symbols)",
+                                          use_container_width=True, disabled=not portfolio_symbols,
+                                          key="run_portfolio")
+
+        if run_portfolio_clicked:
+            start_dt = pd.Timestamp(start_date)
+            end_dt = pd.Timestamp(end_date) + pd.Timedelta(days=1)
+            portfolio_status = st.empty()
+            portfolio_status.info(f"Fetching bars for {len(portfolio_symbols)} symbols...")
+            interval_kwargs = {'interval': intraday_interval} if trade_type == "Intraday" else {}
+            futures = {s: submit_fetch(fetch_bars_range, s, start_dt, end_dt, **interval_kwargs)
+                       for s in portfolio_symbols}
+            basket_bars = {}
+            for s, future in futures.items():
+                try:
+                    bars = future.result()
+                except Exception:
+                    bars = Bars.empty_bars()
+                if not bars.empty:
+                    basket_bars[s] = bars
+            if not basket_bars:
+                portfolio_status.error("❌ No historical data available for selected dates!")
+            else:
+                portfolio_started = time.perf_counter()
+                st.session_state.portfolio_result = run_portfolio(basket_bars, BacktestConfig(
+                    position=position,
+                    entry_mode=entry_mode,
+                    trade_type=trade_type,
+                    investment=investment,
+                    max_loss_pct=max_loss_pct,
+                    max_total_loss_pct=max_total_loss_pct,
+                    recalc_levels=recalc_levels,
+                    brokerage_per_trade=brokerage_per_trade,
+                    stt_rate=stt_rate,
+                    transaction_charges=transaction_charges,
+                    gst_rate=gst_rate,
+                    level_spec=level_spec,
+                ))
+                st.session_state.portfolio_label = (
+                    f"{len(basket_bars)} symbols • {trade_type}"
+                    f"{f' ({intraday_interval})' if trade_type == 'Intraday' else ''} • {position} • "
+                    f"{entry_mode} • {start_date} → {end_date}"
+                )
+                missing = [s for s in portfolio_symbols if s not in basket_bars]
+                portfolio_status.success(f"✅ Portfolio backtest finished in {time.perf_counter() - portfolio_started:.2f}s"
+                                         + (f" • no data for {', '.join(missing)}" if missing else ""))
+
+        portfolio_result = st.session_state.get('portfolio_result')
+        if portfolio_result is not None and portfolio_result.symbols:
+            st.markdown(f"**Portfolio results** — {st.session_state.portfolio_label}")
+            col_pf1, col_pf2, col_pf3, col_pf4, col_pf5 = st.columns(5)
+            with col_pf1:
+                st.metric("Final Capital", f"₹{portfolio_result.final_capital:,.0f}",
+                          f"{portfolio_result.return_pct:.2f}%")
+            with col_pf2:
+                st.metric("Win Rate", f"{portfolio_result.win_rate:.1f}%")
+            with col_pf3:
+                st.metric("Max Drawdown", f"{max_drawdown_pct(portfolio_result.equity):.2f}%")
+            with col_pf4:
+                st.metric("Trades", len(portfolio_result.trade_log))
+            with col_pf5:
+                st.metric("Costs", f"₹{portfolio_result.total_costs:,.0f}")
+            if portfolio_result.halted_at is not None:
+                st.warning(f"🛑 Max total loss reached on {portfolio_result.index[portfolio_result.halted_at]:%Y-%m-%d %H:%M}: "
+                           f"all positions closed and trading stopped")
+
+            fig_portfolio = go.Figure()
+            fig_portfolio.add_trace(go.Scatter(
+                x=portfolio_result.index,
+                y=portfolio_result.equity,
+                mode='lines',
+                name='Portfolio',
+                line=dict(color='#667eea', width=2),
+                hovertemplate='Date: %{x}<br>Capital: ₹%{y:,.0f}<extra></extra>'
+            ))
+            fig_portfolio.add_hline(y=portfolio_result.initial_capital, line_dash="dash", line_color="gray")
+            fig_portfolio.update_layout(title="Shared Capital", height=350, template="plotly_white",
+                                        xaxis_title="Date", yaxis_title="Capital (₹)")
+            st.plotly_chart(fig_portfolio, use_container_width=True)
+
+            st.markdown("**By symbol**")
+            st.dataframe(portfolio_result.by_symbol().round(2).rename(columns={
+                'trades': 'Trades', 'win_rate': 'Win Rate %', 'pnl': 'Net P&L (₹)', 'costs': 'Costs (₹)',
+            }), use_container_width=True)
+
+            if portfolio_result.trade_log:
+                st.markdown("**Trades** (in the order they closed)")
+                portfolio_trades = pd.DataFrame(portfolio_result.trades, columns=[
+                    'trade_num', 'symbol', 'entry_date', 'entry_price', 'position_size', 'exit_date',
+                    'exit_price', 'result', 'pnl', 'capital_after',
+                ])
+                st.dataframe(portfolio_trades.round({'entry_price': 2, 'exit_price': 2, 'pnl': 2, 'capital_after': 2}).rename(columns={
+                    'trade_num': '#', 'symbol': 'Symbol', 'entry_date': 'Entry', 'entry_price': 'Entry Price',
+                    'position_size': 'Qty', 'exit_date': 'Exit', 'exit_price': 'Exit Price', 'result': 'Result',
+                    'pnl': 'Net P&L (₹)', 'capital_after': 'Capital After (₹)',
+                }), use_container_width=True, hide_index=True)
+
     # ==================== Run Simulation ====================
     if run_simulation:
         stock_symbol = sim_stock
         
-        # Show simulation animation
+        # Show simulation progress with the run's parameters while the downloads finish
         sim_placeholder = st.empty()
-        with sim_placeholder.container():
-            st.markdown(
-                """
+        run_summary = (
+            f"{stock_symbol} • {trade_type}{f' ({intraday_interval})' if trade_type == 'Intraday' else ''} • "
+            f"{position} • {entry_mode} • {start_date} → {end_date} • Capital ₹{investment:,.0f} • "
+            f"Risk {max_loss_pct}%/trade, {max_total_loss_pct}% max"
+        )
+        
+        def show_progress(detail):
+            sim_placeholder.markdown(
+                f"""
                 <div class='sim-result-box simulating' style='text-align:center;'>
                     <h3>⚙️ Running Simulation...</h3>
-                    <p>Fetching historical data and analyzing patterns...</p>
+                    <p>{run_summary}</p>
+                    <p>{detail}</p>
                 </div>
                 """,
                 unsafe_allow_html=True
             )
-        time.sleep(1.5)
+        
+        show_progress("Fetching historical data and analyzing patterns...")
         
         # Fetch historical data
         try:
-            ticker = yf.Ticker(stock_symbol)
-            # Convert dates to datetime and add one day to end_date to include it
-            start_dt = pd.Timestamp(start_date)
-            end_dt = pd.Timestamp(end_date) + pd.Timedelta(days=1)
-            
-            # Fetch data with appropriate interval
             if trade_type == "Intraday":
-                # For intraday, fetch with specified interval
-                hist_data = ticker.history(start=start_dt, end=end_dt, interval=intraday_interval)
+                hist_data = history_future.result()
                 st.info(f"📊 Fetching intraday data with {intraday_interval} interval. This allows multiple trades per day based on time!")
             else:
-                # For Position/Swing, use daily data
-                hist_data = ticker.history(start=start_dt, end=end_dt)
+                hist_data = history_future.result()
             
             if hist_data.empty:
                 st.error("❌ No historical data available for selected dates!")
@@ -1067,8 +1386,9 @@ with tab2:
             
             # ==================== Calculate Initial Levels ====================
             # Use the OPENING price of the first day to calculate initial levels
-            start_price = float(hist_data.iloc[0]['Open'])
-            initial_levels = calculate_levels(start_price)
+            start_price = float(hist_data.open[0])
+            price_tick = tick_size(stock_symbol)
+            initial_levels = cached_levels(start_price, price_tick, level_spec)
             
             if trade_type == "Intraday" or not recalc_levels:
                 st.info(f"📊 Square-of-9 levels calculated from opening price on {hist_data.index[0].strftime('%Y-%m-%d')}: ₹{start_price:.2f}")
@@ -1136,478 +1456,32 @@ with tab2:
             
             # ==================== Risk-Based Multi-Trade Simulation ====================
             
+            backtest = BacktestEngine(BacktestConfig(
+                position=position,
+                entry_mode=entry_mode,
+                trade_type=trade_type,
+                investment=investment,
+                max_loss_pct=max_loss_pct,
+                max_total_loss_pct=max_total_loss_pct,
+                recalc_levels=recalc_levels,
+                brokerage_per_trade=brokerage_per_trade,
+                stt_rate=stt_rate,
+                transaction_charges=transaction_charges,
+                gst_rate=gst_rate,
+                tick=price_tick,
+                level_spec=level_spec,
+            )).run(hist_data)
+            
             # Initialize capital tracking
             initial_capital = investment
-            current_capital = investment
-            max_total_loss_amount = investment * (max_total_loss_pct / 100)
-            min_capital = investment - max_total_loss_amount
-            
-            # Track all trades and costs
-            all_trades = []
-            trade_count = 0
-            cumulative_pnl = 0
-            total_brokerage_paid = 0
-            total_costs_paid = 0
-            
-            # Track level changes for visualization
-            level_history = []
-            
-            # Previous close for recalculation
-            prev_close = start_price
-            
-            # Current trade state
-            in_trade = False
-            current_trade = {}
-            
-            # Helper function to close trade with costs
-            def close_trade_with_costs(entry_p, exit_p, qty, gross_pnl):
-                costs = calculate_trading_costs(entry_p, exit_p, qty, 
-                                               brokerage_per_trade, stt_rate, transaction_charges, gst_rate)
-                net_pnl = gross_pnl - costs['total']
-                return net_pnl, costs['total'], costs['brokerage']
-            
-            for day_idx, (idx, row) in enumerate(hist_data.iterrows()):
-                open_price = row['Open']
-                high = row['High']
-                low = row['Low']
-                close_price = row['Close']
-                
-                # Check if we've hit max loss limit
-                if current_capital <= min_capital:
-                    break
-                
-                # Recalculate levels if needed
-                if day_idx == 0:
-                    current_levels = initial_levels
-                    calc_price = start_price
-                    current_trading_day = idx.date() if hasattr(idx, 'date') else idx
-                elif trade_type == "Position/Swing" and recalc_levels and not in_trade:
-                    current_levels = calculate_levels(prev_close)
-                    calc_price = prev_close
-                elif not in_trade:
-                    if trade_type == "Intraday":
-                        # For intraday with minute data, recalculate levels only at start of new trading day
-                        timestamp_date = idx.date() if hasattr(idx, 'date') else idx
-                        if timestamp_date != current_trading_day:
-                            # New trading day started
-                            current_levels = calculate_levels(open_price)
-                            calc_price = open_price
-                            current_trading_day = timestamp_date
-                        # else: use existing levels for the same trading day
-                    else:
-                        current_levels = calculate_levels(prev_close) if day_idx > 0 else initial_levels
-                        calc_price = prev_close if day_idx > 0 else start_price
-                
-                # Determine entry, SL, targets if not in trade
-                if not in_trade:
-                    if trade_type == "Intraday":
-                        if position == "Long":
-                            entry_price = current_levels['buy']
-                            stop_loss = current_levels['sell']
-                            targets = current_levels['bull_targets'][:3]
-                        else:
-                            entry_price = current_levels['sell']
-                            stop_loss = current_levels['buy']
-                            targets = current_levels['bear_targets'][:3]
-                    else:  # Position/Swing
-                        if position == "Long":
-                            entry_price = current_levels['buy']
-                            stop_loss = current_levels['supports'][0]
-                            targets = current_levels['resistances'][:3]
-                        else:
-                            entry_price = current_levels['sell']
-                            stop_loss = current_levels['resistances'][0]
-                            targets = current_levels['supports'][:3]
-                    
-                    # Calculate position size based on risk
-                    risk_per_share = abs(entry_price - stop_loss)
-                    if risk_per_share > 0:
-                        max_risk_amount = current_capital * (max_loss_pct / 100)
-                        position_size = int(max_risk_amount / risk_per_share)
-                        position_size = max(1, min(position_size, int(current_capital / entry_price)))
-                    else:
-                        position_size = int(current_capital / entry_price)
-                    
-                    level_history.append({
-                        'date': idx,
-                        'calc_price': calc_price,
-                        'entry': entry_price,
-                        'sl': stop_loss,
-                        'targets': targets.copy()
-                    })
-                
-                # Check if entry was triggered
-                if not in_trade:
-                    entry_triggered = False
-                    actual_entry_price = entry_price
-                    
-                    if entry_mode == "Wait for Level":
-                        # Traditional: Wait for price to reach the calculated level
-                        if low <= entry_price <= high:
-                            entry_triggered = True
-                            actual_entry_price = entry_price
-                    else:
-                        # Immediate Entry: Enter at market if conditions allow
-                        # For Long: enter if current price is below entry level (good entry)
-                        # For Short: enter if current price is above entry level (good entry)
-                        if position == "Long":
-                            if open_price <= entry_price:
-                                entry_triggered = True
-                                actual_entry_price = open_price
-                        else:  # Short
-                            if open_price >= entry_price:
-                                entry_triggered = True
-                                actual_entry_price = open_price
-                    
-                    if entry_triggered:
-                        # Recalculate position size with actual entry price
-                        risk_per_share = abs(actual_entry_price - stop_loss)
-                        if risk_per_share > 0:
-                            max_risk_amount = current_capital * (max_loss_pct / 100)
-                            position_size = int(max_risk_amount / risk_per_share)
-                            position_size = max(1, min(position_size, int(current_capital / actual_entry_price)))
-                        else:
-                            position_size = int(current_capital / actual_entry_price)
-                        
-                        in_trade = True
-                        trade_count += 1
-                        current_trade = {
-                            'trade_num': trade_count,
-                            'entry_date': idx,
-                            'entry_price': actual_entry_price,
-                            'stop_loss': stop_loss,
-                            'targets': targets.copy(),
-                            'position_size': position_size,
-                            'position_type': position,
-                            'remaining_size': position_size,  # Track remaining position
-                            'partial_exits': []  # Track partial exits
-                        }
-                        
-                        # For Position/Swing, don't check same candle exit - hold position
-                        # For Intraday, check same candle
-                        if trade_type == "Intraday":
-                            if position == "Long":
-                                if low <= stop_loss:
-                                    exit_price = stop_loss
-                                    result = "Stop Loss Hit"
-                                    pnl_per_share = exit_price - entry_price
-                                    gross_pnl = pnl_per_share * position_size
-                                    
-                                    # Calculate trading costs
-                                    costs = calculate_trading_costs(entry_price, exit_price, position_size, 
-                                                                   brokerage_per_trade, stt_rate, transaction_charges, gst_rate)
-                                    net_pnl = gross_pnl - costs['total']
-                                    
-                                    current_capital += net_pnl
-                                    cumulative_pnl += net_pnl
-                                    total_costs_paid += costs['total']
-                                    total_brokerage_paid += costs['brokerage']
-                                    
-                                    current_trade.update({
-                                        'exit_date': idx,
-                                        'exit_price': exit_price,
-                                        'result': result,
-                                        'gross_pnl': gross_pnl,
-                                        'costs': costs['total'],
-                                        'pnl': net_pnl,
-                                        'capital_after': current_capital
-                                    })
-                                    all_trades.append(current_trade.copy())
-                                    in_trade = False
-                                else:
-                                    # Check for highest target hit on intraday
-                                    for i in range(len(targets)-1, -1, -1):
-                                        if high >= targets[i]:
-                                            exit_price = targets[i]
-                                            result = f"Target {i+1} Hit"
-                                            pnl_per_share = exit_price - entry_price
-                                            gross_pnl = pnl_per_share * position_size
-                                            net_pnl, total_cost, brokerage = close_trade_with_costs(entry_price, exit_price, position_size, gross_pnl)
-                                            
-                                            current_capital += net_pnl
-                                            cumulative_pnl += net_pnl
-                                            total_costs_paid += total_cost
-                                            total_brokerage_paid += brokerage
-                                            
-                                            current_trade.update({
-                                                'exit_date': idx,
-                                                'exit_price': exit_price,
-                                                'result': result,
-                                                'gross_pnl': gross_pnl,
-                                                'costs': total_cost,
-                                                'pnl': net_pnl,
-                                                'capital_after': current_capital
-                                            })
-                                            all_trades.append(current_trade.copy())
-                                            in_trade = False
-                                            break
-                            else:  # Short intraday
-                                if high >= stop_loss:
-                                    exit_price = stop_loss
-                                    result = "Stop Loss Hit"
-                                    pnl_per_share = entry_price - exit_price
-                                    gross_pnl = pnl_per_share * position_size
-                                    net_pnl, total_cost, brokerage = close_trade_with_costs(entry_price, exit_price, position_size, gross_pnl)
-                                    
-                                    current_capital += net_pnl
-                                    cumulative_pnl += net_pnl
-                                    total_costs_paid += total_cost
-                                    total_brokerage_paid += brokerage
-                                    
-                                    current_trade.update({
-                                        'exit_date': idx,
-                                        'exit_price': exit_price,
-                                        'result': result,
-                                        'gross_pnl': gross_pnl,
-                                        'costs': total_cost,
-                                        'pnl': net_pnl,
-                                        'capital_after': current_capital
-                                    })
-                                    all_trades.append(current_trade.copy())
-                                    in_trade = False
-                                else:
-                                    # Check for lowest target hit on intraday
-                                    for i in range(len(targets)-1, -1, -1):
-                                        if low <= targets[i]:
-                                            exit_price = targets[i]
-                                            result = f"Target {i+1} Hit"
-                                            pnl_per_share = entry_price - exit_price
-                                            gross_pnl = pnl_per_share * position_size
-                                            net_pnl, total_cost, brokerage = close_trade_with_costs(entry_price, exit_price, position_size, gross_pnl)
-                                            
-                                            current_capital += net_pnl
-                                            cumulative_pnl += net_pnl
-                                            total_costs_paid += total_cost
-                                            total_brokerage_paid += brokerage
-                                            
-                                            current_trade.update({
-                                                'exit_date': idx,
-                                                'exit_price': exit_price,
-                                                'result': result,
-                                                'gross_pnl': gross_pnl,
-                                                'costs': total_cost,
-                                                'pnl': net_pnl,
-                                                'capital_after': current_capital
-                                            })
-                                            all_trades.append(current_trade.copy())
-                                            in_trade = False
-                                            break
-                else:
-                    # In trade - check for exit (Position/Swing holds across days)
-                    if position == "Long":
-                        # Check stop loss first
-                        if low <= current_trade['stop_loss']:
-                            exit_price = current_trade['stop_loss']
-                            result = "Stop Loss Hit"
-                            remaining = current_trade['remaining_size']
-                            pnl_per_share = exit_price - current_trade['entry_price']
-                            gross_pnl = pnl_per_share * remaining
-                            net_pnl, total_cost, brokerage = close_trade_with_costs(current_trade['entry_price'], exit_price, remaining, gross_pnl)
-                            
-                            current_capital += net_pnl
-                            cumulative_pnl += net_pnl
-                            total_costs_paid += total_cost
-                            total_brokerage_paid += brokerage
-                            
-                            current_trade.update({
-                                'exit_date': idx,
-                                'exit_price': exit_price,
-                                'result': result,
-                                'gross_pnl': gross_pnl,
-                                'costs': total_cost,
-                                'pnl': net_pnl,
-                                'capital_after': current_capital
-                            })
-                            all_trades.append(current_trade.copy())
-                            in_trade = False
-                        else:
-                            # Check targets - take partial profits
-                            for i, target in enumerate(current_trade['targets']):
-                                if high >= target and current_trade['remaining_size'] > 0:
-                                    # Partial exit: sell 1/3 of remaining position at each target
-                                    exit_size = max(1, current_trade['remaining_size'] // 3) if i < len(current_trade['targets'])-1 else current_trade['remaining_size']
-                                    pnl_per_share = target - current_trade['entry_price']
-                                    gross_partial_pnl = pnl_per_share * exit_size
-                                    net_partial_pnl, partial_cost, partial_broker = close_trade_with_costs(current_trade['entry_price'], target, exit_size, gross_partial_pnl)
-                                    
-                                    current_capital += net_partial_pnl
-                                    cumulative_pnl += net_partial_pnl
-                                    total_costs_paid += partial_cost
-                                    total_brokerage_paid += partial_broker
-                                    
-                                    current_trade['remaining_size'] -= exit_size
-                                    current_trade['partial_exits'].append({
-                                        'date': idx,
-                                        'target': i+1,
-                                        'price': target,
-                                        'size': exit_size,
-                                        'gross_pnl': gross_partial_pnl,
-                                        'costs': partial_cost,
-                                        'pnl': net_partial_pnl
-                                    })
-                                    
-                                    # If all position closed
-                                    if current_trade['remaining_size'] <= 0:
-                                        total_gross = sum([pe['gross_pnl'] for pe in current_trade['partial_exits']])
-                                        total_costs_sum = sum([pe['costs'] for pe in current_trade['partial_exits']])
-                                        current_trade.update({
-                                            'exit_date': idx,
-                                            'exit_price': target,
-                                            'result': f"All Targets Hit (Final: T{i+1})",
-                                            'gross_pnl': total_gross,
-                                            'costs': total_costs_sum,
-                                            'pnl': sum([pe['pnl'] for pe in current_trade['partial_exits']]),
-                                            'capital_after': current_capital
-                                        })
-                                        all_trades.append(current_trade.copy())
-                                        in_trade = False
-                                        break
-                    else:  # Short position
-                        # Check stop loss first
-                        if high >= current_trade['stop_loss']:
-                            exit_price = current_trade['stop_loss']
-                            result = "Stop Loss Hit"
-                            remaining = current_trade['remaining_size']
-                            pnl_per_share = current_trade['entry_price'] - exit_price
-                            gross_pnl = pnl_per_share * remaining
-                            net_pnl, total_cost, brokerage = close_trade_with_costs(current_trade['entry_price'], exit_price, remaining, gross_pnl)
-                            
-                            current_capital += net_pnl
-                            cumulative_pnl += net_pnl
-                            total_costs_paid += total_cost
-                            total_brokerage_paid += brokerage
-                            
-                            current_trade.update({
-                                'exit_date': idx,
-                                'exit_price': exit_price,
-                                'result': result,
-                                'gross_pnl': gross_pnl,
-                                'costs': total_cost,
-                                'pnl': net_pnl,
-                                'capital_after': current_capital
-                            })
-                            all_trades.append(current_trade.copy())
-                            in_trade = False
-                        else:
-                            # Check targets - take partial profits
-                            for i, target in enumerate(current_trade['targets']):
-                                if low <= target and current_trade['remaining_size'] > 0:
-                                    # Partial exit: cover 1/3 of remaining position at each target
-                                    exit_size = max(1, current_trade['remaining_size'] // 3) if i < len(current_trade['targets'])-1 else current_trade['remaining_size']
-                                    pnl_per_share = current_trade['entry_price'] - target
-                                    gross_partial_pnl = pnl_per_share * exit_size
-                                    net_partial_pnl, partial_cost, partial_broker = close_trade_with_costs(current_trade['entry_price'], target, exit_size, gross_partial_pnl)
-                                    
-                                    current_capital += net_partial_pnl
-                                    cumulative_pnl += net_partial_pnl
-                                    total_costs_paid += partial_cost
-                                    total_brokerage_paid += partial_broker
-                                    
-                                    current_trade['remaining_size'] -= exit_size
-                                    current_trade['partial_exits'].append({
-                                        'date': idx,
-                                        'target': i+1,
-                                        'price': target,
-                                        'size': exit_size,
-                                        'gross_pnl': gross_partial_pnl,
-                                        'costs': partial_cost,
-                                        'pnl': net_partial_pnl
-                                    })
-                                    
-                                    # If all position closed
-                                    if current_trade['remaining_size'] <= 0:
-                                        total_gross = sum([pe['gross_pnl'] for pe in current_trade['partial_exits']])
-                                        total_costs_sum = sum([pe['costs'] for pe in current_trade['partial_exits']])
-                                        current_trade.update({
-                                            'exit_date': idx,
-                                            'exit_price': target,
-                                            'result': f"All Targets Hit (Final: T{i+1})",
-                                            'gross_pnl': total_gross,
-                                            'costs': total_costs_sum,
-                                            'pnl': sum([pe['pnl'] for pe in current_trade['partial_exits']]),
-                                            'capital_after': current_capital
-                                        })
-                                        all_trades.append(current_trade.copy())
-                                        in_trade = False
-                                        break
-                    
-                    # For intraday, must exit by end of trading day
-                    if trade_type == "Intraday" and in_trade:
-                        # Check if this is the last candle of the trading day
-                        is_last_candle_of_day = False
-                        if day_idx < len(hist_data) - 1:
-                            current_date = idx.date() if hasattr(idx, 'date') else idx
-                            next_date = hist_data.index[day_idx + 1].date() if hasattr(hist_data.index[day_idx + 1], 'date') else hist_data.index[day_idx + 1]
-                            is_last_candle_of_day = (current_date != next_date)
-                        else:
-                            is_last_candle_of_day = True  # Last candle in entire dataset
-                        
-                        if is_last_candle_of_day:
-                            exit_price = close_price
-                            remaining = current_trade['remaining_size']
-                            pnl_per_share = (exit_price - current_trade['entry_price']) if position == "Long" else (current_trade['entry_price'] - exit_price)
-                            gross_pnl = pnl_per_share * remaining
-                            net_pnl, total_cost, brokerage = close_trade_with_costs(current_trade['entry_price'], exit_price, remaining, gross_pnl)
-                            
-                            # Add to any partial profits already taken (they already have costs deducted)
-                            if current_trade['partial_exits']:
-                                net_pnl += sum([pe['pnl'] for pe in current_trade['partial_exits']])
-                            
-                            current_capital += net_pnl
-                            cumulative_pnl += net_pnl
-                            total_costs_paid += total_cost
-                            total_brokerage_paid += brokerage
-                            
-                            current_trade.update({
-                                'exit_date': idx,
-                                'exit_price': exit_price,
-                                'result': "EOD Exit" if current_trade['partial_exits'] else "Position Open (Exited at Close)",
-                                'gross_pnl': gross_pnl + (sum([pe['gross_pnl'] for pe in current_trade['partial_exits']]) if current_trade['partial_exits'] else 0),
-                                'costs': total_cost + (sum([pe['costs'] for pe in current_trade['partial_exits']]) if current_trade['partial_exits'] else 0),
-                                'pnl': net_pnl,
-                                'capital_after': current_capital
-                            })
-                            all_trades.append(current_trade.copy())
-                            in_trade = False
-                    
-                    # For Position/Swing, continue if multiple trades allowed
-                    # Don't break the loop - let it continue to look for new entries
-                
-                # Update previous close
-                prev_close = close_price
-            
-            # Close any open position at end
-            if in_trade:
-                exit_price = hist_data.iloc[-1]['Close']
-                pnl_per_share = (exit_price - current_trade['entry_price']) if position == "Long" else (current_trade['entry_price'] - exit_price)
-                remaining = current_trade['remaining_size']
-                gross_pnl = pnl_per_share * remaining
-                net_pnl, total_cost, brokerage = close_trade_with_costs(current_trade['entry_price'], exit_price, remaining, gross_pnl)
-                
-                # Add partial exit profits
-                if current_trade.get('partial_exits'):
-                    net_pnl += sum([pe['pnl'] for pe in current_trade['partial_exits']])
-                    gross_pnl += sum([pe['gross_pnl'] for pe in current_trade['partial_exits']])
-                    total_cost += sum([pe['costs'] for pe in current_trade['partial_exits']])
-                
-                current_capital += net_pnl
-                cumulative_pnl += net_pnl
-                total_costs_paid += total_cost
-                total_brokerage_paid += brokerage
-                
-                current_trade.update({
-                    'exit_date': hist_data.index[-1],
-                    'exit_price': exit_price,
-                    'result': "Position Open (Exited at Close)",
-                    'gross_pnl': gross_pnl,
-                    'costs': total_cost,
-                    'pnl': net_pnl,
-                    'capital_after': current_capital
-                })
-                all_trades.append(current_trade.copy())
-            
-            # Store final levels used
-            final_levels = current_levels if 'current_levels' in locals() else initial_levels
+            current_capital = backtest.final_capital
+            all_trades = backtest.trades
+            cumulative_pnl = backtest.cumulative_pnl
+            total_brokerage_paid = backtest.total_brokerage
+            total_costs_paid = backtest.total_costs
+            level_history = backtest.level_history
+            final_levels = backtest.final_levels
+            entry_price, stop_loss, targets = backtest.last_setup
             
             # Calculate overall statistics
             total_trades = len(all_trades)
@@ -1617,8 +1491,8 @@ with tab2:
             final_return_pct = ((current_capital - initial_capital) / initial_capital) * 100
             
             # Calculate Buy & Hold comparison
-            buy_hold_start_price = float(hist_data.iloc[0]['Open'])
-            buy_hold_end_price = float(hist_data.iloc[-1]['Close'])
+            buy_hold_start_price = float(hist_data.open[0])
+            buy_hold_end_price = float(hist_data.close[-1])
             buy_hold_shares = int(initial_capital / buy_hold_start_price)
             buy_hold_investment = buy_hold_shares * buy_hold_start_price
             buy_hold_final_value_gross = buy_hold_shares * buy_hold_end_price
@@ -1976,10 +1850,10 @@ with tab2:
             # Candlestick
             fig.add_trace(go.Candlestick(
                 x=hist_data.index,
-                open=hist_data['Open'],
-                high=hist_data['High'],
-                low=hist_data['Low'],
-                close=hist_data['Close'],
+                open=hist_data.open,
+                high=hist_data.high,
+                low=hist_data.low,
+                close=hist_data.close,
                 name='Price',
                 increasing_line_color='#0c6f3c',
                 decreasing_line_color='#c53030'
@@ -2150,21 +2024,11 @@ with tab2:
             
             # Build buy & hold value over time
             buy_hold_dates = hist_data.index.tolist()
-            buy_hold_values = [buy_hold_shares * row['Close'] for _, row in hist_data.iterrows()]
+            buy_hold_values = (buy_hold_shares * hist_data.close.astype(np.float64)).tolist()
             
             # Build strategy capital history (interpolated for all dates)
             strategy_dates = hist_data.index.tolist()
-            strategy_values = []
-            
-            current_val = initial_capital
-            trade_idx = 0
-            
-            for date in hist_data.index:
-                # Check if any trade closed on or before this date
-                while trade_idx < len(all_trades) and all_trades[trade_idx]['exit_date'] <= date:
-                    current_val = all_trades[trade_idx]['capital_after']
-                    trade_idx += 1
-                strategy_values.append(current_val)
+            strategy_values = backtest.equity.tolist()
             
             fig_comparison = go.Figure()
             
@@ -2265,9 +2129,13 @@ with tab2:
 # TAB 3: PAPER TRADING
 # ====================================
 with tab3:
+    set_screen("Paper Trading")
     st.header("📈 Paper Trading")
     
-    st.info("💡 **Paper Trading Mode**: Uses yfinance data (15-20 min delayed) - Completely virtual, NO real money involved!")
+    if get_provider().name == "replay":
+        st.info(f"💡 **Paper Trading Mode**: Replaying recorded data from `{get_provider().root}` - Completely virtual, NO real money involved!")
+    else:
+        st.info("💡 **Paper Trading Mode**: Uses yfinance data (15-20 min delayed) - Completely virtual, NO real money involved!")
     
     # Initialize session state
     if 'paper_trading_active' not in st.session_state:
@@ -2285,6 +2153,12 @@ with tab3:
         st.session_state.paper_levels = None
     if 'paper_session_reports' not in st.session_state:
         st.session_state.paper_session_reports = []
+    if 'paper_session_id' not in st.session_state:
+        st.session_state.paper_session_id = uuid.uuid4().hex
+    
+    # Intraday and swing sessions poll the same 1-minute series so every session on a symbol
+    # shares one fetch; only the latest close is used, so coarser bars are never needed here
+    PAPER_POLL_PERIOD, PAPER_POLL_INTERVAL = '5d', '1m'
     
     st.markdown("---")
     st.subheader("⚙️ Configuration")
@@ -2299,7 +2173,7 @@ with tab3:
             help="For Indian stocks, use format: SYMBOL.NS (e.g., RELIANCE.NS). For US stocks, just the symbol (e.g., AAPL)",
             key="paper_symbol_input"
         )
-        paper_symbol = paper_symbol_input
+        paper_symbol = resolve_symbol_input(paper_symbol_input)
     
     with col2:
         paper_trade_type = st.radio(
@@ -2435,11 +2309,11 @@ with tab3:
         if paper_trade_type == "Intraday":
             default_interval = 90
             min_interval = 60
-            help_text = "Min 60s to avoid yfinance rate limits. Data is 15-20 min delayed."
+            help_text = "How fresh this session's prices must be. Fetches are shared across sessions and capped by a global request budget. Data is 15-20 min delayed."
         else:
             default_interval = 300
             min_interval = 180
-            help_text = "Min 180s for swing trading. Data is 15-20 min delayed."
+            help_text = "Min 180s for swing trading. Fetches are shared across sessions and capped by a global request budget. Data is 15-20 min delayed."
         
         paper_refresh_interval = st.number_input(
             "Auto-Refresh Interval (sec)",
@@ -2567,6 +2441,10 @@ with tab3:
                 st.session_state.paper_session_reports.append(report)
                 st.success("✅ Session report saved! View in Reports tab.")
             
+            # Release this session's share of the polling demand
+            if portfolio.get('symbol'):
+                get_scheduler().unsubscribe(portfolio['symbol'], PAPER_POLL_PERIOD, PAPER_POLL_INTERVAL, st.session_state.paper_session_id)
+            
             st.session_state.paper_trading_active = False
             st.warning("⏸️ Paper trading stopped")
             st.rerun()
@@ -2674,47 +2552,30 @@ with tab3:
             st.info("🟡 Market is CLOSED - No new trades")
         
         try:
-            # Smart data fetching with rate limit protection
+            # Shared rate-limited polling: demand for this symbol is merged with every other
+            # session and refreshed by one process-wide scheduler within the request budget
             refresh_interval = portfolio.get('refresh_interval', 90)
-            last_fetch = portfolio.get('last_data_fetch')
-            
-            # Check if we should fetch new data
-            should_fetch = False
-            if last_fetch is None:
-                should_fetch = True
-            else:
-                # Parse last fetch time
-                try:
-                    last_fetch_time = datetime.strptime(last_fetch, "%Y-%m-%d %H:%M:%S")
-                    time_since_fetch = (datetime.now() - last_fetch_time).total_seconds()
-                    if time_since_fetch >= refresh_interval:
-                        should_fetch = True
-                except:
-                    should_fetch = True
-            
-            # Fetch data if needed
-            if should_fetch:
-                ticker = yf.Ticker(symbol)
-                
-                # Use appropriate interval based on trade type
-                if trade_type == "Intraday":
-                    hist = ticker.history(period='1d', interval='1m')
-                else:
-                    # For swing trading, use 5-minute intervals to reduce API calls
-                    hist = ticker.history(period='5d', interval='5m')
-                
-                if not hist.empty:
-                    current_price = hist['Close'].iloc[-1]
-                    portfolio['current_price'] = current_price
-                    portfolio['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    portfolio['last_data_fetch'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                else:
-                    st.warning("⚠️ No data received from yfinance. Using last known price.")
-                    current_price = portfolio.get('current_price', 0)
+            hist, fetched_at = get_scheduler().poll(
+                symbol, PAPER_POLL_PERIOD, PAPER_POLL_INTERVAL,
+                max_age=refresh_interval,
+                subscriber=st.session_state.paper_session_id
+            )
+            fetched_at_str = fetched_at.strftime("%Y-%m-%d %H:%M:%S") if fetched_at else None
+            
+            # A snapshot this session has not consumed yet counts as a fresh fetch
+            if fetched_at_str is not None and fetched_at_str != portfolio.get('last_data_fetch'):
+                current_price = hist.last_close()
+                portfolio['current_price'] = current_price
+                portfolio['last_update'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                portfolio['last_data_fetch'] = fetched_at_str
+            elif fetched_at is None:
+                st.warning("⚠️ No data received from yfinance. Using last known price.")
+                current_price = portfolio.get('current_price', 0)
             else:
                 # Use cached price
                 current_price = portfolio.get('current_price', 0)
-                time_until_refresh = refresh_interval - time_since_fetch
+                time_since_fetch = (datetime.now() - fetched_at).total_seconds()
+                time_until_refresh = max(0, refresh_interval - time_since_fetch)
                 st.info(f"⏱️ Using cached data. Next refresh in {int(time_until_refresh)}s (Rate limit protection)")
                 
                 # Check if we need to recalculate levels
@@ -2730,7 +2591,7 @@ with tab3:
                     if last_calc_date is None or last_calc_date != current_date:
                         should_recalc = True
                         # For new day, use previous close or today's open
-                        hist_daily = ticker.history(period='5d', interval='1d')
+                        hist_daily = fetch_history(symbol, period='5d', interval='1d')
                         if not hist_daily.empty and len(hist_daily) > 1:
                             if trade_type == "Intraday":
                                 calc_price = hist_daily['Open'].iloc[-1]
@@ -2743,7 +2604,7 @@ with tab3:
                 
                 # Calculate or use existing levels
                 if should_recalc:
-                    current_levels = calculate_levels(calc_price)
+                    current_levels = cached_levels(calc_price, tick_size(symbol), level_spec)
                     st.session_state.paper_levels = current_levels
                     portfolio['last_level_calc_date'] = current_date
                 else:
@@ -3055,6 +2916,7 @@ with tab3:
 # TAB 4: REPORTS DASHBOARD
 # ====================================
 with tab4:
+    set_screen("Reports")
     st.header("📋 Reports Dashboard")
     
     st.info("💡 **View your completed paper trading sessions and download detailed reports**")
@@ -3181,3 +3043,4 @@ with tab4:
                 st.session_state.paper_session_reports = []
                 st.success("✅ All reports cleared!")
                 st.rerun()
+
@@ -0,0 +1,953 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from bar_store import Bars, get_bar_store
+from http_session import call_with_retry, get_session
+from symbols import well_formed
+from telemetry import frame_bytes, get_telemetry
+
+# ==================== TTL / LRU cache ====================
+class TTLCache:
+    """Thread-safe mapping whose entries expire after `ttl` seconds and are evicted LRU-first."""
+
+    def __init__(self, maxsize=256, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value, datetime.now())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stored_at(self, key):
+        """Wall-clock time `key` was last set, or None if it is not held"""
+        with self._lock:
+            entry = self._data.get(key)
+            return None if entry is None else entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ==================== Single-flight ====================
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one execution.
+    The first caller runs the function; callers arriving while it is in flight
+    block and receive the same result (or exception).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.collapsed = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.collapsed += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            return {'executed': self.executed, 'collapsed': self.collapsed, 'in_flight': len(self._calls)}
+
+
+# Module-level state survives Streamlit reruns and is shared by every session in the process
+_history_cache = TTLCache(maxsize=512, ttl=60.0)
+_history_flight = SingleFlight()
+
+
+def _ts_key(value):
+    return None if value is None else str(pd.Timestamp(value))
+
+
+def history_key(symbol, period=None, start=None, end=None, interval="1d"):
+    """Cache key for a history request: (symbol, period, start, end, interval)"""
+    return (symbol.upper(), period, _ts_key(start), _ts_key(end), interval)
+
+
+# ==================== Providers ====================
+class MarketDataProvider:
+    """Source of OHLCV history with the yfinance `Ticker.history` calling convention"""
+
+    name = "base"
+    # Whether fetched ranges should be persisted to the local bar store
+    persist = True
+
+    def history(self, symbol, period=None, start=None, end=None, interval="1d"):
+        raise NotImplementedError
+
+    def history_batch(self, symbols, period=None, start=None, end=None, interval="1d"):
+        """Histories for several symbols as {symbol: frame}; providers may override with one request"""
+        return {
+            symbol: self.history(symbol, period=period, start=start, end=end, interval=interval)
+            for symbol in symbols
+        }
+
+
+# yfinance errors that mean the request worked but the answer is "no such data"; never retried
+_YF_FATAL = tuple(
+    getattr(yf.exceptions, name)
+    for name in ("YFTickerMissingError", "YFPricesMissingError", "YFTzMissingError", "YFInvalidPeriodError")
+    if hasattr(yf.exceptions, name)
+)
+
+
+class YFinanceProvider(MarketDataProvider):
+    """Yahoo Finance through one pooled keep-alive session, with retries and a circuit breaker"""
+
+    name = "yfinance"
+
+    def history(self, symbol, period=None, start=None, end=None, interval="1d"):
+        # A ticker Yahoo cannot spell is answered locally; unlisted but well-formed ones are still asked for
+        if not well_formed(symbol):
+            return pd.DataFrame()
+        kwargs = {'interval': interval}
+        if period is not None:
+            kwargs['period'] = period
+        if start is not None:
+            kwargs['start'] = start
+        if end is not None:
+            kwargs['end'] = end
+        hist, _ = call_with_retry(yf.Ticker(symbol, session=get_session()).history, fatal=_YF_FATAL, **kwargs)
+        return hist
+
+    def history_batch(self, symbols, period=None, start=None, end=None, interval="1d"):
+        frames = {symbol: pd.DataFrame() for symbol in symbols if not well_formed(symbol)}
+        symbols = [symbol for symbol in symbols if symbol not in frames]
+        if len(symbols) < 2:
+            frames.update(super().history_batch(symbols, period=period, start=start, end=end, interval=interval))
+            return frames
+        # Same adjustments/columns as Ticker.history so batched and single frames are interchangeable
+        data, _ = call_with_retry(
+            yf.download,
+            symbols, period=period, start=start, end=end, interval=interval,
+            group_by="ticker", auto_adjust=True, actions=True, ignore_tz=False,
+            threads=True, progress=False, session=get_session(), fatal=_YF_FATAL,
+        )
+        for symbol in symbols:
+            if data is None or data.empty or symbol not in data.columns.get_level_values(0):
+                frames[symbol] = pd.DataFrame()
+                continue
+            # download() aligns every symbol on one index; drop rows where this one did not trade
+            frames[symbol] = data[symbol].dropna(how="all", subset=["Open", "High", "Low", "Close"])
+        return frames
+
+
+_PERIOD_OFFSETS = {
+    "mo": lambda n: pd.DateOffset(months=n),
+    "y": lambda n: pd.DateOffset(years=n),
+}
+
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Serves recorded bars from local files, with no network and no rate limits.
+    Looks for <root>/<SYMBOL>_<interval>.parquet, <root>/<SYMBOL>_<interval>.csv
+    or a bar-store partition <root>/<SYMBOL>/<interval>/bars.parquet.
+    `period` requests are answered relative to `now` (default: the last recorded bar).
+    """
+
+    name = "replay"
+    persist = False
+
+    def __init__(self, root, now=None):
+        self.root = root
+        self.now = None if now is None else pd.Timestamp(now)
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _load(self, symbol, interval):
+        key = (symbol.upper(), interval)
+        with self._lock:
+            if key in self._frames:
+                return self._frames[key]
+        stem = f"{symbol.upper()}_{interval}"
+        candidates = [
+            os.path.join(self.root, stem + ".parquet"),
+            os.path.join(self.root, stem + ".csv"),
+            os.path.join(self.root, symbol.upper(), interval, "bars.parquet"),
+        ]
+        frame = pd.DataFrame()
+        for path in candidates:
+            if not os.path.exists(path):
+                continue
+            if path.endswith(".csv"):
+                frame = pd.read_csv(path, index_col=0)
+                try:
+                    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.index))
+                except (TypeError, ValueError):
+                    # Mixed UTC offsets (e.g. across a DST change) only parse as UTC
+                    frame.index = pd.to_datetime(frame.index, utc=True)
+            else:
+                frame = pd.read_parquet(path)
+            frame = frame.sort_index()
+            break
+        with self._lock:
+            self._frames[key] = frame
+        return frame
+
+    def history(self, symbol, period=None, start=None, end=None, interval="1d"):
+        frame = self._load(symbol, interval)
+        if frame.empty:
+            return frame
+        wall = frame.index.tz_localize(None) if frame.index.tz is not None else frame.index
+        if self.now is not None:
+            frame = frame[wall <= self.now]
+            wall = wall[wall <= self.now]
+            if frame.empty:
+                return frame
+
+        if start is not None or end is not None:
+            mask = np.ones(len(frame), dtype=bool)
+            if start is not None:
+                mask &= wall >= _wall_time(start, frame.index.tz)
+            if end is not None:
+                mask &= wall < _wall_time(end, frame.index.tz)
+            return frame[mask]
+
+        period = period or "1mo"
+        if period == "max":
+            return frame
+        if period == "ytd":
+            return frame[wall >= wall[-1].replace(month=1, day=1).normalize()]
+        if period.endswith("d"):
+            # yfinance counts trading days, so keep the last N distinct session dates
+            days = wall.normalize().unique()[-int(period[:-1]):]
+            return frame[wall.normalize() >= days[0]]
+        for suffix, offset in _PERIOD_OFFSETS.items():
+            if period.endswith(suffix):
+                return frame[wall > wall[-1] - offset(int(period[:-len(suffix)]))]
+        raise ValueError(f"Unsupported period: {period}")
+
+
+def _wall_time(value, tz):
+    """`value` as a naive timestamp on the recording's wall clock (aware values are converted to `tz` first)"""
+    value = pd.Timestamp(value)
+    if value.tz is None:
+        return value
+    return (value.tz_convert(tz) if tz is not None else value).tz_localize(None)
+
+
+def _provider_from_env():
+    if os.environ.get("TRADEGANN_DATA_PROVIDER", "yfinance").lower() == "replay":
+        return ReplayProvider(
+            os.environ.get("TRADEGANN_REPLAY_DIR", "replay_data"),
+            now=os.environ.get("TRADEGANN_REPLAY_NOW") or None,
+        )
+    return YFinanceProvider()
+
+
+_provider = _provider_from_env()
+
+
+def get_provider():
+    return _provider
+
+
+def set_provider(provider):
+    """Switch the process-wide data provider; cached frames from the previous one are dropped"""
+    global _provider
+    _provider = provider
+    _history_cache.clear()
+
+
+# ==================== History fetch ====================
+def fetch_history(symbol, period=None, start=None, end=None, interval="1d", ttl=None, refresh=False):
+    """
+    Cached history lookup through the active provider (yf.Ticker.history semantics).
+    Returned frames are shared between callers and must not be mutated in place.
+    With `refresh` the cache is skipped and the download replaces the cached frame.
+    """
+    key = history_key(symbol, period, start, end, interval)
+    hist = None if refresh else _history_cache.get(key)
+    if hist is not None:
+        get_telemetry().hit(symbol, interval, _provider.name, hist)
+        return hist
+
+    return _history_flight.do(key, _fetch_and_cache, key, symbol, period, start, end, interval, ttl, refresh)
+
+
+def _fetch_and_cache(key, symbol, period, start, end, interval, ttl, refresh=False):
+    # A concurrent leader may have filled the cache between our miss and taking the lead
+    hist = None if refresh else _history_cache.get(key)
+    if hist is not None:
+        return hist
+    with get_telemetry().span(symbol, interval, _provider.name) as span:
+        hist = _provider.history(symbol, period=period, start=start, end=end, interval=interval)
+        span.rows, span.bytes = len(hist), frame_bytes(hist)
+
+    # Empty results are not cached so a mistyped symbol or a transient failure is retried
+    if not hist.empty:
+        _history_cache.set(key, hist, ttl)
+    return hist
+
+
+def fetch_stats():
+    """Counters for the shared history cache and in-flight request coalescing"""
+    return {
+        'cache_hits': _history_cache.hits,
+        'cache_misses': _history_cache.misses,
+        'cache_size': len(_history_cache),
+        **{f"flight_{k}": v for k, v in _history_flight.stats().items()},
+    }
+
+
+def last_close(symbol, period="1d"):
+    """Latest close for `symbol` or None when no data is available"""
+    hist = fetch_history(symbol, period=period)
+    if hist.empty:
+        return None
+    return float(hist['Close'].iloc[-1])
+
+
+def _fetch_gap(symbol, interval, gap_start, gap_end):
+    """Download one bar-store gap: in request-sized chunks for intraday intervals"""
+    if interval in INTRADAY_CHUNK_DAYS:
+        return fetch_history_chunked(symbol, gap_start, gap_end, interval)
+    return fetch_history(symbol, start=gap_start, end=gap_end, interval=interval)
+
+
+def fetch_history_range(symbol, start, end, interval="1d"):
+    """
+    Bars for [start, end) served from the local bar store.
+    Only the sub-ranges the store does not hold yet are downloaded.
+    Coarser intraday intervals are derived from one finer base series when the
+    range is inside the base interval's lookback, so switching intervals is free;
+    providers that are not persisted (replays) serve every interval natively, and
+    an empty base series falls back to the native interval.
+    """
+    if _derives(interval, start):
+        key = ('derived',) + history_key(symbol, None, start, end, interval)
+        bars = _history_cache.get(key)
+        if bars is None:
+            with get_telemetry().span(symbol, interval, "derived") as span:
+                bars = resample_bars(fetch_history_range(symbol, start, end, DERIVED_INTERVALS[interval]), interval)
+                span.rows, span.bytes = len(bars), frame_bytes(bars)
+            if not bars.empty:
+                _history_cache.set(key, bars)
+        else:
+            get_telemetry().hit(symbol, interval, "derived", bars)
+        if not bars.empty:
+            return bars
+
+    if not _provider.persist:
+        return fetch_history(symbol, start=start, end=end, interval=interval)
+
+    # Gap downloads inside are recorded as their own fetch_history calls
+    with get_telemetry().span(symbol, interval, "store", cache="store") as span:
+        bars = get_bar_store().load(symbol, interval, start, end, partial(_fetch_gap, symbol, interval))
+        span.rows, span.bytes = len(bars), frame_bytes(bars)
+    return bars
+
+
+def fetch_bars_range(symbol, start, end, interval="1d"):
+    """
+    fetch_history_range as compact Bars. Stored intervals are read column-wise from
+    the bar store without building a DataFrame; the Bars object is what gets cached.
+    """
+    key = ('bars',) + history_key(symbol, None, start, end, interval)
+    bars = _history_cache.get(key)
+    if bars is not None:
+        get_telemetry().hit(symbol, interval, "bars", bars)
+        return bars
+
+    if _derives(interval, start) or not _provider.persist:
+        bars = Bars.from_frame(fetch_history_range(symbol, start, end, interval))
+    else:
+        with get_telemetry().span(symbol, interval, "store", cache="store") as span:
+            bars = get_bar_store().load_bars(symbol, interval, start, end, partial(_fetch_gap, symbol, interval))
+            span.rows, span.bytes = len(bars), bars.nbytes
+    if not bars.empty:
+        _history_cache.set(key, bars)
+    return bars
+
+
+# ==================== Background fetches ====================
+_fetch_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="market-data-fetch")
+
+
+def submit_fetch(fn, *args, **kwargs):
+    """
+    Run a data-layer call (e.g. fetch_history_range, last_close) on the shared fetch
+    pool and return its Future, so the caller can keep rendering while it downloads.
+    Only pure data work belongs here: Streamlit calls must stay on the script thread.
+    The caller's context (e.g. the telemetry screen tag) is carried into the worker.
+    """
+    return _fetch_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+# ==================== Chunked intraday fetch ====================
+# Longest span Yahoo serves in one intraday request, per interval
+INTRADAY_CHUNK_DAYS = {
+    '1m': 7, '2m': 59, '5m': 59, '15m': 59, '30m': 59, '90m': 59,
+    '60m': 180, '1h': 180,
+}
+# How far back Yahoo keeps intraday bars at all; older ranges can only come from the bar store
+INTRADAY_LOOKBACK_DAYS = {
+    '1m': 30, '2m': 60, '5m': 60, '15m': 60, '30m': 60, '90m': 60,
+    '60m': 730, '1h': 730,
+}
+
+_chunk_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="market-data-chunk")
+
+
+def split_range(start, end, chunk):
+    """Consecutive half-open [a, b) windows of at most `chunk` covering [start, end) exactly"""
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    windows = []
+    while start < end:
+        stop = min(start + chunk, end)
+        windows.append((start, stop))
+        start = stop
+    return windows
+
+
+def fetch_history_chunked(symbol, start, end, interval):
+    """
+    Intraday bars for [start, end) fetched as concurrent per-request-sized chunks.
+    Windows share their boundaries (start inclusive, end exclusive), and the stitched
+    result is de-duplicated and sorted. The part of the range beyond Yahoo's
+    lookback is skipped instead of issuing requests that are bound to fail.
+    """
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    lookback = INTRADAY_LOOKBACK_DAYS.get(interval)
+    if lookback is not None:
+        # One day of slack keeps the first request safely inside the limit
+        start = max(start, pd.Timestamp.now().normalize() - pd.Timedelta(days=lookback - 1))
+    if start >= end:
+        return pd.DataFrame()
+
+    windows = split_range(start, end, pd.Timedelta(days=INTRADAY_CHUNK_DAYS.get(interval, 59)))
+    context = contextvars.copy_context()
+    frames = list(_chunk_pool.map(
+        lambda w: context.copy().run(fetch_history, symbol, start=w[0], end=w[1], interval=interval),
+        windows,
+    ))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    bars = pd.concat(frames)
+    return bars[~bars.index.duplicated(keep="last")].sort_index()
+
+
+def fetch_history_batch(symbols, period=None, start=None, end=None, interval="1d", ttl=None, refresh=False):
+    """
+    Histories for many symbols with a single provider request for the cache misses.
+    Every fetched frame is stored under the same key fetch_history would use.
+    With `refresh` every symbol is re-downloaded, cached or not.
+    """
+    frames = {}
+    missing = []
+    for symbol in symbols:
+        hist = None if refresh else _history_cache.get(history_key(symbol, period, start, end, interval))
+        if hist is None:
+            missing.append(symbol)
+        else:
+            get_telemetry().hit(symbol, interval, _provider.name, hist)
+            frames[symbol] = hist
+    if missing:
+        key = ('batch', tuple(s.upper() for s in missing)) + history_key("", period, start, end, interval)[1:]
+        frames.update(_history_flight.do(key, _fetch_batch_and_cache, missing, period, start, end, interval, ttl))
+    return frames
+
+
+def _fetch_batch_and_cache(symbols, period, start, end, interval, ttl):
+    with get_telemetry().span(",".join(symbols), interval, f"{_provider.name} batch") as span:
+        fetched = _provider.history_batch(symbols, period=period, start=start, end=end, interval=interval)
+        span.rows = sum(len(f) for f in fetched.values())
+        span.bytes = sum(frame_bytes(f) for f in fetched.values())
+    for symbol, hist in fetched.items():
+        if not hist.empty:
+            _history_cache.set(history_key(symbol, period, start, end, interval), hist, ttl)
+    return fetched
+
+
+# ==================== Cache warm-up ====================
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+
+def _warmup_loop(symbol_groups, period, interval, refresh_every):
+    while True:
+        for symbols in symbol_groups:
+            try:
+                # Refresh so every cycle re-downloads; entries outlive one cycle so there
+                # is no window where a popular symbol misses between refreshes
+                fetch_history_batch(symbols, period=period, interval=interval, ttl=2 * refresh_every, refresh=True)
+            except Exception:
+                pass
+        time.sleep(refresh_every)
+
+
+def start_warmup(symbol_groups, period="1d", interval="1d", refresh_every=300):
+    """
+    Start (once per process) a daemon thread that keeps `period` history for every
+    symbol in `symbol_groups` in the cache. Each group is fetched as one batched request,
+    so pass symbols from the same exchange together.
+    """
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is not None and _warmup_thread.is_alive():
+            return _warmup_thread
+        _warmup_thread = threading.Thread(
+            target=_warmup_loop,
+            args=([list(g) for g in symbol_groups], period, interval, refresh_every),
+            name="market-data-warmup",
+            daemon=True,
+        )
+        _warmup_thread.start()
+        return _warmup_thread
+
+
+# ==================== Shared fetch scheduler ====================
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, holding at most `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_take(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def wait_time(self):
+        """Seconds until the next token is available"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+# ==================== Bar ring buffer ====================
+class BarRing:
+    """
+    Fixed-capacity circular buffer of compact OHLCV bars (see bar_store.Bars).
+    append() accepts overlapping frames: older bars are ignored and a bar with the
+    same timestamp as the newest one replaces it (the still-forming bar).
+    """
+
+    COLUMNS = ('time', 'open', 'high', 'low', 'close', 'volume')
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.buffer = Bars(
+            np.zeros(capacity, dtype=np.int64),
+            np.zeros(capacity, dtype=np.float32),
+            np.zeros(capacity, dtype=np.float32),
+            np.zeros(capacity, dtype=np.float32),
+            np.zeros(capacity, dtype=np.float32),
+            np.zeros(capacity, dtype=np.int64),
+        )
+        self.size = 0
+        self.head = 0  # next slot to write
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def _last_slot(self):
+        return (self.head - 1) % self.capacity
+
+    def last_time(self):
+        """Timestamp of the newest bar, or None when empty"""
+        with self._lock:
+            if self.size == 0:
+                return None
+            newest = pd.Timestamp(int(self.buffer.time[self._last_slot()]))
+            tz = self.buffer.tz
+            return newest.tz_localize('UTC').tz_convert(tz) if tz else newest
+
+    def last_close(self):
+        with self._lock:
+            if self.size == 0:
+                return None
+            return float(self.buffer.close[self._last_slot()])
+
+    def append(self, frame):
+        """Add the bars of `frame` newer than (or equal to) the newest held bar; returns rows written"""
+        if frame.empty:
+            return 0
+        new = Bars.from_frame(frame)
+        with self._lock:
+            self.buffer.tz = new.tz
+            if self.size:
+                last = self._last_slot()
+                new = new[int(np.searchsorted(new.time, self.buffer.time[last], side='left')):]
+                if len(new) and new.time[0] == self.buffer.time[last]:
+                    for col in self.COLUMNS:
+                        getattr(self.buffer, col)[last] = getattr(new, col)[0]
+                    new = new[1:]
+            new = new[-self.capacity:]
+            n = len(new)
+            if n:
+                slots = (self.head + np.arange(n)) % self.capacity
+                for col in self.COLUMNS:
+                    getattr(self.buffer, col)[slots] = getattr(new, col)
+                self.head = (self.head + n) % self.capacity
+                self.size = min(self.capacity, self.size + n)
+            return n
+
+    def to_bars(self):
+        """Copy of the held bars, oldest first"""
+        with self._lock:
+            order = (self.head - self.size + np.arange(self.size)) % self.capacity
+            return Bars(*(getattr(self.buffer, col)[order] for col in self.COLUMNS), tz=self.buffer.tz)
+
+    def to_frame(self):
+        """Held bars, oldest first, as an OHLCV DataFrame"""
+        return self.to_bars().to_frame()
+
+
+class _Demand:
+    def __init__(self):
+        self.subscribers = {}  # subscriber id -> (max_age, last heartbeat)
+        self.bars = BarRing()
+        self.fetched_at = None
+        self.last_attempt = None
+        self.error = None
+        self.ready = threading.Event()
+
+    def max_age(self):
+        return min(age for age, _ in self.subscribers.values())
+
+
+class FetchScheduler:
+    """
+    Process-wide poller shared by every Paper Trading session.
+
+    Sessions declare demand with poll(); demand for the same (symbol, period, interval)
+    is merged, so twenty sessions watching one symbol cost one fetch per refresh. The
+    first fetch loads `period`; later ones only ask for bars from the newest held
+    timestamp onwards and append them to the key's BarRing. A
+    single worker thread spends tokens from a bucket sized to `budget_per_minute`,
+    always refreshing the most overdue key first (overdue ratio weighted by the number
+    of subscribers, never-fetched keys first).
+    """
+
+    def __init__(self, budget_per_minute=30, burst=5, idle_timeout=600):
+        self.bucket = TokenBucket(budget_per_minute / 60.0, burst)
+        self.idle_timeout = idle_timeout
+        self._demand = {}
+        self._cond = threading.Condition()
+        self._worker = None
+        self.fetches = 0
+        self.rows_fetched = 0
+        self.errors = 0
+
+    def poll(self, symbol, period, interval, max_age, subscriber="default", wait=15.0):
+        """
+        Register interest and return (bars, fetched_at): the key's BarRing and the time
+        of its last successful refresh, or (None, None) if nothing arrived within `wait`
+        seconds of the first request.
+        """
+        key = (symbol.upper(), period, interval)
+        with self._cond:
+            demand = self._demand.get(key)
+            if demand is None:
+                demand = self._demand[key] = _Demand()
+            demand.subscribers[subscriber] = (max_age, time.monotonic())
+            self._ensure_worker()
+            self._cond.notify()
+        if demand.fetched_at is None and wait:
+            demand.ready.wait(wait)
+        if demand.fetched_at is None:
+            return None, None
+        return demand.bars, demand.fetched_at
+
+    def unsubscribe(self, symbol, period, interval, subscriber="default"):
+        with self._cond:
+            demand = self._demand.get((symbol.upper(), period, interval))
+            if demand is not None:
+                demand.subscribers.pop(subscriber, None)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'keys': len(self._demand),
+                'subscribers': sum(len(d.subscribers) for d in self._demand.values()),
+                'fetches': self.fetches,
+                'rows_fetched': self.rows_fetched,
+                'errors': self.errors,
+                'tokens': round(self.bucket.tokens, 2),
+            }
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="fetch-scheduler", daemon=True)
+            self._worker.start()
+
+    def _next_due(self, now):
+        """(key, seconds until due) for the most urgent key, pruning idle subscribers"""
+        best_key, best_score, soonest = None, None, None
+        for key, demand in list(self._demand.items()):
+            for sub, (_, seen) in list(demand.subscribers.items()):
+                if now - seen > self.idle_timeout:
+                    del demand.subscribers[sub]
+            if not demand.subscribers:
+                del self._demand[key]
+                continue
+            max_age = demand.max_age()
+            if demand.last_attempt is None:
+                return key, 0.0
+            age = now - demand.last_attempt
+            if age >= max_age:
+                score = age / max_age * len(demand.subscribers)
+                if best_score is None or score > best_score:
+                    best_key, best_score = key, score
+            else:
+                soonest = max_age - age if soonest is None else min(soonest, max_age - age)
+        if best_key is not None:
+            return best_key, 0.0
+        return None, soonest
+
+    def _run(self):
+        while True:
+            with self._cond:
+                key, delay = self._next_due(time.monotonic())
+                if key is None:
+                    self._cond.wait(delay if delay is not None else self.idle_timeout)
+                    continue
+            token_wait = self.bucket.wait_time()
+            if token_wait > 0 or not self.bucket.try_take():
+                time.sleep(max(token_wait, 0.05))
+                continue
+            self._fetch(key)
+
+    def _fetch(self, key):
+        symbol, period, interval = key
+        demand = self._demand.get(key)
+        if demand is None:
+            return
+        demand.last_attempt = time.monotonic()
+        since = demand.bars.last_time()
+        try:
+            with get_telemetry().span(symbol, interval, f"{_provider.name} poll") as span:
+                if since is None:
+                    frame = _provider.history(symbol, period=period, interval=interval)
+                else:
+                    # Delta poll: re-request the newest bar too, it may still have been forming
+                    frame = _provider.history(symbol, start=since, interval=interval)
+                span.rows, span.bytes = len(frame), frame_bytes(frame)
+            self.fetches += 1
+        except Exception as e:
+            self.errors += 1
+            demand.error = e
+            demand.ready.set()
+            return
+        self.rows_fetched += len(frame)
+        demand.bars.append(frame)
+        if len(demand.bars):
+            demand.fetched_at = datetime.now()
+            demand.error = None
+        demand.ready.set()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Process-wide FetchScheduler; budget from TRADEGANN_FETCH_BUDGET (requests/minute)"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FetchScheduler(
+                budget_per_minute=float(os.environ.get("TRADEGANN_FETCH_BUDGET", 30)),
+            )
+        return _scheduler
+
+
+# ==================== Local resampling ====================
+# Intervals built locally from a finer base series instead of their own download
+DERIVED_INTERVALS = {'15m': '5m', '30m': '5m', '60m': '5m', '1h': '5m'}
+
+_OHLCV_AGG = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
+
+def _derives(interval, start):
+    """Whether `interval` bars from `start` are resampled from a stored finer series"""
+    base = DERIVED_INTERVALS.get(interval)
+    return base is not None and _provider.persist and _within_lookback(start, base)
+
+
+def _within_lookback(start, interval):
+    lookback = INTRADAY_LOOKBACK_DAYS.get(interval)
+    if lookback is None:
+        return True
+    return pd.Timestamp(start) >= pd.Timestamp.now().normalize() - pd.Timedelta(days=lookback - 1)
+
+
+def interval_to_timedelta(interval):
+    return pd.Timedelta(interval.replace('m', 'min') if interval.endswith('m') else interval)
+
+
+def resample_bars(bars, interval):
+    """
+    Aggregate intraday OHLCV bars into `interval` buckets.
+    Buckets are anchored on each session's first bar (as Yahoo does, e.g. 09:15,
+    10:15, ... for NSE hourly bars) rather than on the clock hour.
+    """
+    if bars.empty:
+        return bars
+    step = interval_to_timedelta(interval)
+    index = bars.index
+    session_open = pd.Series(index, index=index).groupby(index.normalize()).transform('min')
+    offset = (index - pd.DatetimeIndex(session_open)) // step
+    buckets = pd.DatetimeIndex(session_open) + offset * step
+
+    agg = {col: how for col, how in _OHLCV_AGG.items() if col in bars.columns}
+    for col in bars.columns:
+        agg.setdefault(col, 'sum')
+    out = bars.groupby(buckets).agg(agg)
+    out.index.name = bars.index.name
+    return out
+
+
+# ==================== Stale-while-revalidate quotes ====================
+class QuoteCache:
+    """
+    Last known price per symbol. get() answers from memory immediately and, when the
+    quote is older than `max_age`, refreshes it on a background thread so the next
+    rerun sees the new value. Only a symbol that has never been quoted blocks.
+    """
+
+    def __init__(self, max_age=60.0, maxsize=512):
+        self.max_age = max_age
+        self._quotes = TTLCache(maxsize=maxsize, ttl=24 * 3600)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quote-refresh")
+
+    def _load(self, symbol, refresh=False):
+        """Quote from the last close; a revalidation downloads instead of reading the history cache"""
+        hist = fetch_history(symbol, period="1d", refresh=refresh)
+        if hist.empty:
+            return None
+        # Aged from when the frame was downloaded: the history and warm-up caches keep it for minutes
+        fetched_at = _history_cache.stored_at(history_key(symbol, "1d")) or datetime.now()
+        quote = (float(hist['Close'].iloc[-1]), fetched_at)
+        self._quotes.set(symbol, quote)
+        return quote
+
+    def _refresh(self, symbol):
+        try:
+            self._load(symbol, refresh=True)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._refreshing.discard(symbol)
+
+    def get(self, symbol, block=True):
+        """
+        (price, fetched_at) for `symbol`. Without a cached quote, fetches synchronously
+        when `block` (errors propagate) or returns (None, None).
+        """
+        symbol = symbol.upper()
+        quote = self._quotes.get(symbol)
+        if quote is None:
+            if not block:
+                return None, None
+            return self._load(symbol) or (None, None)
+
+        if (datetime.now() - quote[1]).total_seconds() > self.max_age:
+            with self._lock:
+                start = symbol not in self._refreshing
+                self._refreshing.add(symbol)
+            if start:
+                self._pool.submit(self._refresh, symbol)
+        return quote
+
+
+_quote_cache = QuoteCache()
+
+
+def get_quote(symbol, block=True):
+    """Last known price and its timestamp, revalidated in the background when stale"""
+    return _quote_cache.get(symbol, block=block)
+
+
+def format_age(fetched_at):
+    """Human-readable age of a timestamp, e.g. '42s' or '3m 5s'"""
+    seconds = int((datetime.now() - fetched_at).total_seconds())
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
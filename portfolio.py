@@ -0,0 +1,177 @@
+import heapq
+import itertools
+from dataclasses import dataclass, field, replace
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from backtest import BacktestConfig, day_bounds, entry_signals, stamp_trades, walk_bars
+from levels import tick_size
+
+
+# ==================== Result ====================
+@dataclass
+class PortfolioResult:
+    """
+    Output of run_portfolio. `trade_log` holds every symbol's trades in the order
+    they closed, each tagged with its 'symbol' and dated by positions on the shared
+    timeline `index`; `trades` turns those into timestamps. `equity` is the shared
+    capital after the events up to each bar of `index`, and `halted_at` the
+    position where the max-total-loss stop closed everything (None if it never did).
+    """
+
+    config: BacktestConfig
+    symbols: list
+    index: pd.DatetimeIndex
+    trade_log: list = field(default_factory=list)
+    equity: np.ndarray = None
+    final_capital: float = 0.0
+    cumulative_pnl: float = 0.0
+    total_costs: float = 0.0
+    total_brokerage: float = 0.0
+    halted_at: int = None
+
+    @cached_property
+    def trades(self):
+        return stamp_trades(self.trade_log, self.index)
+
+    @property
+    def initial_capital(self):
+        return self.config.investment
+
+    @property
+    def return_pct(self):
+        return (self.final_capital - self.initial_capital) / self.initial_capital * 100
+
+    @property
+    def win_rate(self):
+        if not self.trade_log:
+            return 0
+        return len([t for t in self.trade_log if t['pnl'] > 0]) / len(self.trade_log) * 100
+
+    def by_symbol(self):
+        """Trades, win rate, net P&L and costs of each symbol, every symbol listed"""
+        frame = pd.DataFrame(self.trade_log, columns=['symbol', 'pnl', 'costs'])
+        grouped = frame.groupby('symbol').agg(
+            trades=('pnl', 'size'),
+            win_rate=('pnl', lambda p: (p > 0).mean() * 100),
+            pnl=('pnl', 'sum'),
+            costs=('costs', 'sum'),
+        )
+        return grouped.reindex(self.symbols).fillna({'trades': 0, 'win_rate': 0.0, 'pnl': 0.0, 'costs': 0.0}).astype({'trades': int})
+
+
+# ==================== Portfolio backtest ====================
+def _timeline(bars_list):
+    """Union of every symbol's bar times, as epoch nanoseconds and a DatetimeIndex"""
+    times = np.unique(np.concatenate([bars.time for bars in bars_list]))
+    index = pd.DatetimeIndex(times.view('datetime64[ns]'))
+    tz = bars_list[0].tz
+    return times, index.tz_localize('UTC').tz_convert(tz) if tz else index
+
+
+def run_portfolio(bars_by_symbol, config):
+    """
+    Square-of-9 rules of `config` on every symbol of {symbol: Bars} at once, on one
+    timeline and one pool of capital (config.investment). Each entry risks
+    config.max_loss_pct of the shared capital and is capped by the cash not tied up
+    in open positions; a signal that cannot buy a single share is let pass. Once
+    capital falls to the max-total-loss floor every open position is closed at its
+    last close and trading stops. Symbols keep the tick of their exchange.
+    """
+    symbols = [s for s, bars in bars_by_symbol.items() if not bars.empty]
+    bars_list = [bars_by_symbol[s] for s in symbols]
+    if not symbols:
+        return PortfolioResult(config=config, symbols=[], index=pd.DatetimeIndex([]),
+                               equity=np.empty(0), final_capital=config.investment)
+    configs = [replace(config, tick=tick_size(s)) for s in symbols]
+
+    # Entry signals of every symbol in one vectorized pass over the concatenated bars
+    lengths = np.array([len(bars) for bars in bars_list])
+    starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    ends = starts + lengths
+    o, h, lo, c = (np.concatenate([getattr(bars, name) for bars in bars_list]).astype(np.float64)
+                   for name in ('open', 'high', 'low', 'close'))
+    firsts, day_of = day_bounds(np.concatenate([bars.days for bars in bars_list]), starts)
+    ticks = np.repeat([cfg.tick for cfg in configs], lengths)
+    anchors, entry_bars = entry_signals(config, o, h, lo, c, firsts, day_of, ticks, starts)
+    cuts = entry_bars.searchsorted(np.r_[starts, ends[-1]])
+
+    times, index = _timeline(bars_list)
+    positions = [times.searchsorted(bars.time) for bars in bars_list]
+
+    # Walks share the trade list and numbering; each one's new trades are tagged as it returns
+    closed = []
+    numbers = itertools.count(1)
+    walks = []
+    queue = []
+    for k, (cfg, bars) in enumerate(zip(configs, bars_list)):
+        signals = (anchors[starts[k]:ends[k]], entry_bars[cuts[k]:cuts[k + 1]] - starts[k])
+        walk = walk_bars(cfg, bars, closed, numbers, signals)
+        j, _, _ = next(walk)
+        walks.append(walk)
+        queue.append((positions[k][min(j, lengths[k] - 1)], k))
+    heapq.heapify(queue)
+
+    capital = config.investment
+    min_capital = config.investment - config.investment * (config.max_total_loss_pct / 100)
+    exposure = [0.0] * len(symbols)
+    summaries = [None] * len(symbols)
+    trade_log = []
+    event_at, event_capital = [], []
+    halted_at = None
+
+    def step(k, message):
+        nonlocal capital
+        seen = len(closed)
+        try:
+            j, capital, exposure[k] = walks[k].send(message)
+        except StopIteration as done:
+            summaries[k] = done.value
+            capital = summaries[k]['capital']
+            exposure[k] = 0.0
+            j = None
+        pos = positions[k]
+        for trade in closed[seen:]:
+            trade_log.append(dict(
+                trade, symbol=symbols[k], entry_date=int(pos[trade['entry_date']]),
+                exit_date=int(pos[trade['exit_date']]),
+                partial_exits=[dict(pe, date=int(pos[pe['date']])) for pe in trade['partial_exits']],
+            ))
+        return j
+
+    # Events in timeline order; symbols sharing a bar go in basket order
+    while queue:
+        at, k = heapq.heappop(queue)
+        cash = capital - (sum(exposure) - exposure[k])
+        j = step(k, (capital, cash, None))
+        event_at.append(at)
+        event_capital.append(capital)
+        if j is not None:
+            heapq.heappush(queue, (positions[k][min(j, lengths[k] - 1)], k))
+        if capital <= min_capital:
+            halted_at = int(at)
+            break
+
+    if halted_at is not None:
+        for _, k in sorted(queue, key=lambda item: item[1]):
+            # Settle at the symbol's last bar on or before the halt
+            step(k, (capital, None, max(0, int(positions[k].searchsorted(halted_at, side='right')) - 1)))
+        event_at.append(halted_at)
+        event_capital.append(capital)
+
+    equity = np.r_[config.investment, event_capital][np.searchsorted(event_at, np.arange(len(times)), side='right')]
+    finished = [s for s in summaries if s is not None]
+    return PortfolioResult(
+        config=config,
+        symbols=symbols,
+        index=index,
+        trade_log=trade_log,
+        equity=equity,
+        final_capital=capital,
+        cumulative_pnl=sum(s['cumulative_pnl'] for s in finished),
+        total_costs=sum(s['total_costs'] for s in finished),
+        total_brokerage=sum(s['total_brokerage'] for s in finished),
+        halted_at=halted_at,
+    )
@@ -0,0 +1,119 @@
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+
+from backtest import BacktestEngine
+from bar_store import SharedBars, attach_shared_bars
+
+DEFAULT_WORKERS = int(os.environ.get("TRADEGANN_SWEEP_WORKERS", "0")) or os.cpu_count() or 1
+
+# Grid keys that pick the bar data rather than a BacktestConfig field
+DATA_KEYS = ('interval',)
+
+# Result columns, best first when ranking: (column, ascending)
+RANKINGS = {
+    'return_pct': False,
+    'win_rate': False,
+    'max_drawdown_pct': True,
+    'total_costs': True,
+}
+
+
+# ==================== Grid ====================
+def expand_grid(grid):
+    """Every combination of a {name: [values]} grid as a list of {name: value} dicts"""
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def max_drawdown_pct(equity):
+    """Largest fall from a running peak of the equity curve, in percent of that peak"""
+    if len(equity) == 0:
+        return 0.0
+    peak = np.maximum.accumulate(equity)
+    return float(((peak - equity) / peak).max() * 100)
+
+
+def summarize(result):
+    """Ranking metrics of one BacktestResult"""
+    return {
+        'return_pct': result.return_pct,
+        'win_rate': result.win_rate,
+        'max_drawdown_pct': max_drawdown_pct(result.equity),
+        'trades': len(result.trade_log),
+        'total_costs': result.total_costs,
+        'final_capital': result.final_capital,
+    }
+
+
+def rank_results(rows, by='return_pct'):
+    """Sweep rows as a DataFrame, best first by `by` (ties broken by smaller drawdown)"""
+    frame = pd.DataFrame(rows)
+    if frame.empty:
+        return frame
+    keys = [by] + [k for k in ('max_drawdown_pct',) if k != by]
+    return frame.sort_values(keys, ascending=[RANKINGS[k] for k in keys], kind='stable').reset_index(drop=True)
+
+
+# ==================== Worker side ====================
+_worker_bars = {}
+
+
+def _init_worker(handles):
+    global _worker_bars
+    _worker_bars = {interval: attach_shared_bars(handle) for interval, handle in handles.items()}
+
+
+def _run_job(base_config, params):
+    changes = {k: v for k, v in params.items() if k not in DATA_KEYS}
+    bars = _worker_bars[params.get('interval')]
+    return summarize(BacktestEngine(replace(base_config, **changes)).run(bars))
+
+
+# ==================== Sweep ====================
+def run_sweep(bars_by_interval, base_config, grid, workers=DEFAULT_WORKERS, on_result=None, should_stop=None):
+    """
+    Backtest every combination of `grid` ({name: [values]}: BacktestConfig fields,
+    plus 'interval' to choose among `bars_by_interval`) on a process pool.
+    The bars are copied once into shared memory and workers attach to them through
+    small handles, so neither the data nor its memory is multiplied by the worker
+    count; jobs carry only parameters.
+    on_result(row, done, total) runs in the calling thread as results arrive, and
+    should_stop() is polled between them: once it returns True, or if the caller
+    is interrupted, jobs not yet started are cancelled. Returns the rows finished,
+    best return first.
+    """
+    if 'interval' not in grid:
+        grid = dict(grid, interval=[next(iter(bars_by_interval))])
+    combos = expand_grid(grid)
+    rows = []
+    shared = {interval: SharedBars(bars) for interval, bars in bars_by_interval.items()}
+    # The app process runs server and download threads, which a forked child would inherit mid-lock
+    pool = ProcessPoolExecutor(
+        max_workers=max(1, min(workers, len(combos))),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=({interval: block.handle for interval, block in shared.items()},),
+    )
+    try:
+        pending = {pool.submit(_run_job, base_config, params): params for params in combos}
+        while pending:
+            if should_stop is not None and should_stop():
+                break
+            done, _ = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+            for future in done:
+                row = dict(pending.pop(future), **future.result())
+                rows.append(row)
+                if on_result is not None:
+                    on_result(row, len(rows), len(combos))
+    finally:
+        # Let running jobs finish so no worker still starting up looks for an unlinked block
+        pool.shutdown(wait=True, cancel_futures=True)
+        for block in shared.values():
+            block.close()
+    return rank_results(rows)
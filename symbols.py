@@ -0,0 +1,261 @@
+import bisect
+import io
+import json
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+
+from http_session import get_session
+
+DEFAULT_SYMBOL_ROOT = os.environ.get(
+    "TRADEGANN_SYMBOL_MASTER",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".symbol_master"),
+)
+
+# Yahoo suffix per market; US listings carry none
+MARKET_SUFFIX = {'NSE': '.NS', 'BSE': '.BO', 'US': ''}
+
+_NSE_EQUITY_URL = "https://archives.nseindia.com/content/equities/EQUITY_L.csv"
+_BSE_EQUITY_URL = (
+    "https://api.bseindia.com/BseIndiaAPI/api/ListofScripData/w"
+    "?Group=&Scripcode=&industry=&segment=Equity&status=Active"
+)
+_US_LISTING_URLS = (
+    "https://www.nasdaqtrader.com/dynamic/SymDir/nasdaqlisted.txt",
+    "https://www.nasdaqtrader.com/dynamic/SymDir/otherlisted.txt",
+)
+# Exchange sites reject requests without a browser-like agent
+_HEADERS = {"User-Agent": "Mozilla/5.0", "Referer": "https://www.bseindia.com/"}
+
+# Plain US tickers as Yahoo spells them: share classes use a dash (BRK-B)
+_US_TICKER = re.compile(r"^[A-Z]{1,5}(-[A-Z]{1,2})?$")
+# Any Yahoo ticker before its exchange suffix: letters, digits, & and - (M&M, BRK-B, 500325),
+# a leading ^ for indices (^NSEI) and a trailing =F / =X for futures and currencies
+_TICKER_ROOT = re.compile(r"^\^?[A-Z0-9][A-Z0-9&-]{0,19}(=[FX])?$")
+# Exchange suffixes Yahoo uses; a dotted ticker ending in anything else cannot exist
+YAHOO_SUFFIXES = frozenset({
+    'NS', 'BO', 'L', 'IL', 'TO', 'V', 'CN', 'NE', 'AX', 'NZ', 'HK', 'T', 'SS', 'SZ', 'TW', 'TWO', 'KS', 'KQ',
+    'SI', 'JK', 'KL', 'BK', 'VN', 'DE', 'F', 'BE', 'DU', 'HM', 'MU', 'SG', 'PA', 'AS', 'BR', 'LS', 'MI', 'MC',
+    'SW', 'VI', 'ST', 'OL', 'CO', 'HE', 'IC', 'IR', 'AT', 'WA', 'PR', 'BD', 'IS', 'ME', 'TA', 'SR', 'QA', 'KW',
+    'CA', 'JO', 'SA', 'MX', 'BA', 'SN', 'LM', 'CR', 'TL', 'RG', 'VS',
+})
+
+
+# ==================== Downloads ====================
+def _download_nse():
+    resp = get_session().get(_NSE_EQUITY_URL, headers=_HEADERS, timeout=15)
+    resp.raise_for_status()
+    table = pd.read_csv(io.StringIO(resp.text))
+    table.columns = [c.strip() for c in table.columns]
+    return [(str(s).strip().upper(), str(n).strip()) for s, n in zip(table['SYMBOL'], table['NAME OF COMPANY'])]
+
+
+def _download_bse():
+    resp = get_session().get(_BSE_EQUITY_URL, headers=_HEADERS, timeout=15)
+    resp.raise_for_status()
+    rows = []
+    for scrip in resp.json():
+        name = str(scrip.get('Scrip_Name') or scrip.get('Issuer_Name') or '').strip()
+        # Yahoo accepts both the BSE trading symbol and the numeric scrip code
+        for code in (scrip.get('scrip_id'), scrip.get('SCRIP_CD')):
+            if code:
+                rows.append((str(code).strip().upper(), name))
+    return rows
+
+
+def _download_us():
+    rows = []
+    for url in _US_LISTING_URLS:
+        resp = get_session().get(url, headers=_HEADERS, timeout=15)
+        resp.raise_for_status()
+        table = pd.read_csv(io.StringIO(resp.text), sep="|")
+        symbol_col = 'Symbol' if 'Symbol' in table.columns else 'ACT Symbol'
+        table = table[table['Test Issue'] != 'Y']
+        for symbol, name in zip(table[symbol_col], table['Security Name']):
+            if isinstance(symbol, str) and not symbol.startswith('File Creation Time'):
+                rows.append((symbol.strip().upper().replace('.', '-'), str(name).strip()))
+    return rows
+
+
+_DOWNLOADERS = {'NSE': _download_nse, 'BSE': _download_bse, 'US': _download_us}
+
+
+# ==================== Ticker syntax ====================
+def well_formed(ticker):
+    """Whether `ticker` is spelled like a Yahoo symbol; only these are worth a request"""
+    ticker = ticker.strip().upper()
+    root, dot, suffix = ticker.rpartition('.')
+    if not dot:
+        root = ticker
+    elif suffix not in YAHOO_SUFFIXES:
+        return False
+    return bool(_TICKER_ROOT.match(root))
+
+
+# ==================== Symbol master ====================
+class SymbolMaster:
+    """
+    Locally cached NSE/BSE/US listings held as one sorted array of Yahoo tickers.
+    Exact lookups and prefix completion are binary searches over that array.
+    Lists are kept as <root>/<MARKET>.json and refreshed in the background when
+    older than `max_age_days`. The lists miss ETFs, SME boards, mutual funds and OTC
+    names, so they only advise: an unlisted ticker is flagged, never refused. Only
+    tickers that cannot be spelled on Yahoo at all are.
+    """
+
+    def __init__(self, root=DEFAULT_SYMBOL_ROOT, max_age_days=7, retry_after=600):
+        self.root = root
+        self.max_age = max_age_days * 86400
+        self.retry_after = retry_after
+        self._last_attempt = None
+        self._lock = threading.Lock()
+        self._listings = {}  # market -> [(ticker, name)]
+        self._tickers = []  # sorted Yahoo tickers across all loaded markets
+        self._names = []
+        self._refreshing = False
+        for market in MARKET_SUFFIX:
+            self._load(market)
+        self._rebuild()
+
+    def _path(self, market):
+        return os.path.join(self.root, f"{market}.json")
+
+    def _load(self, market):
+        try:
+            with open(self._path(market)) as f:
+                self._listings[market] = [tuple(row) for row in json.load(f)]
+        except (OSError, ValueError):
+            pass
+
+    def _rebuild(self):
+        rows = {}
+        for market, listing in self._listings.items():
+            suffix = MARKET_SUFFIX[market]
+            for symbol, name in listing:
+                rows.setdefault(symbol + suffix, name)
+        ordered = sorted(rows.items())
+        with self._lock:
+            self._tickers = [ticker for ticker, _ in ordered]
+            self._names = [name for _, name in ordered]
+
+    # ---------- Refresh ----------
+    def stale_markets(self):
+        now = time.time()
+        stale = []
+        for market in MARKET_SUFFIX:
+            try:
+                fresh = now - os.path.getmtime(self._path(market)) < self.max_age
+            except OSError:
+                fresh = False
+            if not fresh:
+                stale.append(market)
+        return stale
+
+    def refresh(self, markets=None):
+        """Download the listings of `markets` (default: stale ones); failures keep the cached list"""
+        os.makedirs(self.root, exist_ok=True)
+        for market in (self.stale_markets() if markets is None else markets):
+            try:
+                listing = _DOWNLOADERS[market]()
+            except Exception:
+                continue
+            if not listing:
+                continue
+            path = self._path(market)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(listing, f)
+            os.replace(tmp, path)
+            self._listings[market] = listing
+        self._rebuild()
+
+    def refresh_in_background(self):
+        """Start one refresh thread if any market is stale (at most once per `retry_after` seconds)"""
+        now = time.monotonic()
+        with self._lock:
+            if self._refreshing or (self._last_attempt is not None and now - self._last_attempt < self.retry_after):
+                return
+            if not self.stale_markets():
+                return
+            self._refreshing = True
+            self._last_attempt = now
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="symbol-master-refresh", daemon=True).start()
+
+    # ---------- Lookups ----------
+    def __contains__(self, ticker):
+        with self._lock:
+            i = bisect.bisect_left(self._tickers, ticker)
+            return i < len(self._tickers) and self._tickers[i] == ticker
+
+    def market_of(self, ticker):
+        """Market whose listing decides whether `ticker` exists, or None if it is not one we index"""
+        if ticker.endswith('.NS'):
+            return 'NSE'
+        if ticker.endswith('.BO'):
+            return 'BSE'
+        if _US_TICKER.match(ticker):
+            return 'US'
+        return None
+
+    def covers(self, market):
+        return bool(self._listings.get(market))
+
+    def resolve(self, text):
+        """
+        Normalize user input to a Yahoo ticker. Returns (ticker, status) where status is
+        'known' (listed), 'unknown' (well formed but not listed; may still be an ETF,
+        fund or OTC name) or 'invalid' (empty, or not a possible Yahoo spelling).
+        A bare Indian symbol gets .NS (or .BO) appended and BRK.B becomes BRK-B.
+        """
+        ticker = text.strip().upper()
+        if not ticker:
+            return "", 'invalid'
+        root, dot, suffix = ticker.rpartition('.')
+        if dot and len(suffix) == 1 and suffix not in YAHOO_SUFFIXES and _US_TICKER.match(f"{root}-{suffix}"):
+            # US share class typed with a dot (BRK.B)
+            ticker = f"{root}-{suffix}"
+        if ticker in self:
+            return ticker, 'known'
+        if '.' not in ticker:
+            for suffix in ('.NS', '.BO'):
+                if ticker + suffix in self:
+                    return ticker + suffix, 'known'
+        return ticker, 'unknown' if well_formed(ticker) else 'invalid'
+
+    def complete(self, prefix, limit=8):
+        """Up to `limit` (ticker, name) pairs whose ticker starts with `prefix`"""
+        prefix = prefix.strip().upper()
+        if not prefix:
+            return []
+        with self._lock:
+            lo = bisect.bisect_left(self._tickers, prefix)
+            hi = min(bisect.bisect_left(self._tickers, prefix + '\uffff'), lo + limit)
+            return list(zip(self._tickers[lo:hi], self._names[lo:hi]))
+
+    def __len__(self):
+        return len(self._tickers)
+
+
+_default_master = None
+_default_master_lock = threading.Lock()
+
+
+def get_symbol_master():
+    """Process-wide SymbolMaster; kicks off a background refresh of stale listings"""
+    global _default_master
+    with _default_master_lock:
+        if _default_master is None:
+            _default_master = SymbolMaster()
+    _default_master.refresh_in_background()
+    return _default_master
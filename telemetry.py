@@ -0,0 +1,216 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Screen (tab) that triggered the current data call; background threads report "background"
+_screen = contextvars.ContextVar("telemetry_screen", default="background")
+# Span being timed; a context variable so chunk workers running in a copied context nest under it
+_span = contextvars.ContextVar("telemetry_span", default=None)
+
+
+def set_screen(name):
+    """Tag data calls made from here on (in this thread/context) with a screen name"""
+    _screen.set(name)
+
+
+def current_screen():
+    return _screen.get()
+
+
+def frame_bytes(frame):
+    """In-memory size of a history frame (index included)"""
+    if frame is None or len(frame) == 0:
+        return 0
+    return int(frame.memory_usage(index=True, deep=False).sum())
+
+
+# ==================== Histogram ====================
+class Histogram:
+    """Fixed-bucket latency histogram with count/sum, cheap enough to update on every call"""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        i = int(np.searchsorted(self.bounds, value, side="left"))
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+
+    def labels(self):
+        edges = [f"≤{b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return [f"{e} ms" for e in edges]
+
+    def to_dict(self):
+        return dict(zip(self.labels(), self.counts))
+
+
+# ==================== Recorder ====================
+class Span:
+    """Mutable record of one data call, filled in while the call runs"""
+
+    __slots__ = ('symbol', 'interval', 'source', 'cache', 'rows', 'bytes', 'retries', 'error', 'started', 'children')
+
+    def __init__(self, symbol, interval, source, cache):
+        self.symbol = symbol
+        self.interval = interval
+        self.source = source
+        self.cache = cache
+        self.rows = 0
+        self.bytes = 0
+        self.retries = 0
+        self.error = None
+        self.started = time.perf_counter()
+        self.children = []  # (start, end) perf_counter times of the spans nested directly inside
+
+
+def _covered_ms(intervals):
+    """Milliseconds covered by the union of (start, end) intervals; overlapping parts count once"""
+    total, reach = 0.0, None
+    for start, end in sorted(intervals):
+        if reach is None or start > reach:
+            total += end - start
+            reach = end
+        elif end > reach:
+            total += end - reach
+            reach = end
+    return total * 1000.0
+
+
+class Telemetry:
+    """
+    Per-call data-layer metrics: symbol, interval, screen, cache outcome, rows, bytes,
+    latency, retries and error. `latency_ms` is a call's wall time and `self_ms` the
+    part of it not covered by spans nested inside (parallel chunks count once), so
+    summing self_ms counts every second once. The most recent `maxlen` calls are kept
+    verbatim; latency histograms per cache outcome cover every call since start.
+    """
+
+    def __init__(self, maxlen=10000):
+        self.events = deque(maxlen=maxlen)
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, span, latency_ms=None):
+        if latency_ms is None:
+            latency_ms = (time.perf_counter() - span.started) * 1000.0
+        event = {
+            'time': datetime.now(),
+            'screen': current_screen(),
+            'symbol': span.symbol,
+            'interval': span.interval,
+            'source': span.source,
+            'cache': span.cache,
+            'rows': span.rows,
+            'bytes': span.bytes,
+            'latency_ms': latency_ms,
+            'self_ms': max(latency_ms - _covered_ms(span.children), 0.0),
+            'retries': span.retries,
+            'error': span.error,
+        }
+        with self._lock:
+            self.events.append(event)
+            hist = self.histograms.get(span.cache)
+            if hist is None:
+                hist = self.histograms[span.cache] = Histogram()
+            hist.add(latency_ms)
+
+    def hit(self, symbol, interval, source, frame):
+        """Record a call answered from memory"""
+        span = Span(symbol, interval, source, "hit")
+        span.rows = len(frame)
+        span.bytes = frame_bytes(frame) if isinstance(frame, pd.DataFrame) else getattr(frame, 'nbytes', 0)
+        self.record(span, latency_ms=0.0)
+
+    def span(self, symbol, interval, source, cache="miss"):
+        """Context manager timing one call; retries inside it are counted via note_retry()"""
+        return _SpanContext(self, Span(symbol, interval, source, cache))
+
+    def to_frame(self):
+        with self._lock:
+            return pd.DataFrame(list(self.events))
+
+    def busy_ms(self):
+        """Wall time during which at least one recorded call was running; parallel calls count once"""
+        events = self.to_frame()
+        if events.empty:
+            return 0.0
+        ends = events['time'].to_numpy().astype('datetime64[ns]').astype(np.int64) / 1e9
+        return _covered_ms(zip(ends - events['latency_ms'].to_numpy() / 1000.0, ends))
+
+    def histogram_frame(self):
+        """Bucket counts per cache outcome, one column each"""
+        with self._lock:
+            return pd.DataFrame({cache: hist.to_dict() for cache, hist in self.histograms.items()})
+
+    def summary(self, by=('screen', 'symbol', 'interval')):
+        """Calls, misses, total (self) and percentile latency, rows and bytes grouped by `by`, costliest first"""
+        events = self.to_frame()
+        if events.empty:
+            return events
+        grouped = events.groupby(list(by))
+        out = pd.DataFrame({
+            'calls': grouped.size(),
+            'misses': grouped['cache'].agg(lambda c: int((c != 'hit').sum())),
+            'total_ms': grouped['self_ms'].sum(),
+            'p50_ms': grouped['latency_ms'].median(),
+            'p95_ms': grouped['latency_ms'].quantile(0.95),
+            'rows': grouped['rows'].sum(),
+            'bytes': grouped['bytes'].sum(),
+            'retries': grouped['retries'].sum(),
+            'errors': grouped['error'].count(),
+        })
+        return out.sort_values('total_ms', ascending=False).reset_index()
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+            self.histograms.clear()
+
+
+class _SpanContext:
+    def __init__(self, telemetry, span):
+        self.telemetry = telemetry
+        self.span = span
+
+    def __enter__(self):
+        self.outer = _span.get()
+        self.token = _span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _span.reset(self.token)
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        ended = time.perf_counter()
+        if self.outer is not None:
+            # Chunks of one outer span finish on several threads
+            with self.telemetry._lock:
+                self.outer.children.append((self.span.started, ended))
+        self.telemetry.record(self.span, (ended - self.span.started) * 1000.0)
+        return False
+
+
+def note_retry():
+    """Count a retry against the call being timed in this context, if any"""
+    span = _span.get()
+    if span is not None:
+        span.retries += 1
+
+
+_telemetry = Telemetry()
+
+
+def get_telemetry():
+    return _telemetry
@@ -0,0 +1,48 @@
+"""
+BarStore gap bookkeeping with a fake fetch function (no network).
+
+    python -m pytest -q test_bar_store.py
+"""
+import numpy as np
+import pandas as pd
+
+from bar_store import BarStore
+
+
+def daily_frame(start, end):
+    index = pd.bdate_range(start, end, inclusive="left", tz="Asia/Kolkata")
+    ones = np.ones(len(index))
+    return pd.DataFrame({'Open': ones, 'High': ones, 'Low': ones, 'Close': ones, 'Volume': ones}, index=index)
+
+
+class FakeFetch:
+    def __init__(self, empty=False):
+        self.empty = empty
+        self.calls = []
+
+    def __call__(self, start, end):
+        self.calls.append((start, end))
+        frame = daily_frame(start, end)
+        return frame.iloc[:0] if self.empty else frame
+
+
+def test_empty_weekday_fetch_is_retried(tmp_path):
+    store = BarStore(str(tmp_path))
+    store.load("X.NS", "1d", "2024-01-01", "2024-01-09", FakeFetch())
+    # Tuesday 2024-01-09 comes back empty (a dropped request looks exactly like this)
+    store.load("X.NS", "1d", "2024-01-09", "2024-01-10", FakeFetch(empty=True))
+    assert store.covered_ranges("X.NS", "1d")[-1][1] == pd.Timestamp("2024-01-09")
+
+    retry = FakeFetch()
+    bars = store.load("X.NS", "1d", "2024-01-09", "2024-01-10", retry)
+    assert retry.calls == [(pd.Timestamp("2024-01-09"), pd.Timestamp("2024-01-10"))]
+    assert len(bars) == 1
+
+
+def test_empty_weekend_fetch_is_held(tmp_path):
+    store = BarStore(str(tmp_path))
+    store.load("X.NS", "1d", "2024-01-01", "2024-01-06", FakeFetch())
+    store.load("X.NS", "1d", "2024-01-06", "2024-01-08", FakeFetch(empty=True))
+    retry = FakeFetch()
+    store.load("X.NS", "1d", "2024-01-01", "2024-01-08", retry)
+    assert retry.calls == []
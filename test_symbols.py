@@ -0,0 +1,39 @@
+"""
+SymbolMaster lookups on small local listings (no downloads).
+
+    python -m pytest -q test_symbols.py
+"""
+import json
+
+import pytest
+
+from symbols import SymbolMaster, well_formed
+
+
+@pytest.fixture
+def master(tmp_path):
+    (tmp_path / "NSE.json").write_text(json.dumps([["RELIANCE", "Reliance Industries"], ["TCS", "TCS"]]))
+    (tmp_path / "US.json").write_text(json.dumps([["AAPL", "Apple"], ["BRK-B", "Berkshire Hathaway"]]))
+    return SymbolMaster(root=str(tmp_path))
+
+
+@pytest.mark.parametrize("ticker", ["RELIANCE.NS", "M&M.NS", "500325.BO", "BRK-B", "^NSEI", "GC=F", "EURUSD=X", "VOD.L"])
+def test_well_formed(ticker):
+    assert well_formed(ticker)
+
+
+@pytest.mark.parametrize("ticker", ["", "RELI ANCE", "$$$", "RELIANCE.XX", ".NS", "A..NS"])
+def test_malformed(ticker):
+    assert not well_formed(ticker)
+
+
+def test_resolve(master):
+    assert master.resolve("reliance") == ("RELIANCE.NS", 'known')
+    assert master.resolve("brk.b") == ("BRK-B", 'known')
+    # Missing from the lists but possible (ETFs, funds, OTC): advisory only
+    assert master.resolve("NIFTYBEES.NS") == ("NIFTYBEES.NS", 'unknown')
+    assert master.resolve("VFIAX") == ("VFIAX", 'unknown')
+    # Cannot exist on Yahoo: rejected without a request
+    assert master.resolve("RELI ANCE")[1] == 'invalid'
+    assert master.resolve("$$$")[1] == 'invalid'
+    assert master.resolve("TCS.XX")[1] == 'invalid'
@@ -0,0 +1,50 @@
+"""
+Span timing and retry accounting in telemetry (no network).
+
+    python -m pytest -q test_telemetry.py
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from urllib3.exceptions import ConnectTimeoutError
+
+from http_session import _CountingRetry, CircuitBreaker, call_with_retry
+from telemetry import Telemetry
+
+
+def test_parallel_children_count_once():
+    telemetry = Telemetry()
+
+    def chunk():
+        with telemetry.span("X", "5m", "yfinance"):
+            time.sleep(0.1)
+
+    with telemetry.span("X", "15m", "derived"):
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(3) as pool:
+            list(pool.map(lambda _: context.copy().run(chunk), range(3)))
+
+    events = telemetry.to_frame()
+    outer = events[events['source'] == "derived"].iloc[0]
+    # The three chunks overlap, so the outer call spent almost nothing of its own
+    assert outer['self_ms'] < 0.5 * outer['latency_ms']
+    assert 90 <= telemetry.busy_ms() < 200
+
+
+def test_retries_are_counted_on_the_span():
+    telemetry = Telemetry()
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError("reset")
+        return "ok"
+
+    with telemetry.span("X", "1d", "yfinance"):
+        call_with_retry(flaky, retries=3, breaker=CircuitBreaker())
+        # A retry made inside the HTTP session itself
+        _CountingRetry(total=3).increment(method="GET", url="/", error=ConnectTimeoutError())
+
+    assert telemetry.to_frame()['retries'].iloc[0] == 3